@@ -29,8 +29,12 @@ The Client package contains methods and objects useful for local proxies to
 remote Servers.
 """
 
+import collections, hashlib, hmac, os, threading, time
+
 import Pyro
 
+from .. import LuxFireConfig
+
 class ClientException(Exception):
 	'''
 	Exception raised by client objects
@@ -40,6 +44,12 @@ class ClientException(Exception):
 class ServerLocator(object):
 	'''
 	Locate a remote pyro service by name using a pyro NS
+	
+	The NS proxy is shared by the whole process, and name lookups are
+	cached for Pyro.config.NS_CACHE_TTL seconds, so that repeated calls
+	don't pay the NS discovery and lookup latency every time. Group
+	listings are not cached; they are brought up to date on every call
+	with the NS changes made since the last one.
 	'''
 	
 	# Pyro Name server
@@ -61,17 +71,38 @@ class ServerLocator(object):
 		import Pyro.core
 		import Pyro.naming
 		try:
-			self.ns = Pyro.naming.locateNS()
+			self.ns = Pyro.naming.sharedNS()
 		except Pyro.errors.NamingError as err:
 			raise ClientException('FATAL ERROR: Cannot find Pyro NameServer: %s' % err)
+		
+		self.proxies = {}
+		self.proxies_lock = threading.Lock()
+		
+		# Dict of group: (NS version, {name: uri}) as last synced
+		self.groups = {}
+		self.groups_lock = threading.Lock()
 	
 	def get_by_name(self, name):
 		'''
-		Get a remote service by name
+		Get a remote service by name. The proxy can be shared between
+		threads, concurrent calls are made over separate connections.
+		The same proxy is returned for as long as the name resolves to
+		the same URI.
 		'''
 		
 		if self.ns is not None:
-			return Pyro.core.Proxy( self.ns.lookup(name) )
+			try:
+				uri = Pyro.naming.resolve('PYRONAME:%s' % name)
+			except Pyro.errors.PyroError:
+				# The listing we got the name from is out of date
+				self.forget(name)
+				raise
+			with self.proxies_lock:
+				proxy = self.proxies.get(name)
+				if proxy is None or proxy._pyroUri != uri:
+					proxy = Pyro.core.PooledProxy(uri)
+					self.proxies[name] = proxy
+				return proxy
 	
 	def get_list(self, group):
 		'''
@@ -79,7 +110,54 @@ class ServerLocator(object):
 		'''
 		
 		if self.ns is not None:
-			return self.ns.list(group)
+			return self.sync_list(group)
+	
+	def sync_list(self, group):
+		'''
+		Bring the listing of group up to date by fetching only the NS
+		changes made since it was last synced
+		'''
+		
+		with self.groups_lock:
+			version, names = self.groups.get(group, (None, {}))
+		
+		try:
+			version, changes, complete = Pyro.naming.sharedNS().changes_since(version, group)
+		except Pyro.errors.CommunicationError:
+			# The NS may have moved, locate it again next time
+			Pyro.naming.forgetNS()
+			self.forget()
+			raise
+		if complete:
+			names = changes
+		else:
+			names = names.copy()
+			for name, uri in changes.items():
+				if uri is None:
+					names.pop(name, None)
+				else:
+					names[name] = uri
+		
+		with self.groups_lock:
+			self.groups[group] = (version, names)
+		return names.copy()
+	
+	def forget(self, name=None):
+		'''
+		Forget the cached lookup of name, or all cached lookups and group
+		listings if name is None. Use this when a service doesn't answer, it
+		may have moved.
+		'''
+		
+		with self.proxies_lock:
+			if name is None:
+				self.proxies.clear()
+			else:
+				self.proxies.pop(name, None)
+		if name is None:
+			with self.groups_lock:
+				self.groups.clear()
+		Pyro.naming.clearCache()
 
 def ListLuxFireGroup(grp='Renderer'):
 	try:
@@ -89,3 +167,99 @@ def ListLuxFireGroup(grp='Renderer'):
 		print('LuxFire Pyro NS group Lux.%s not found - No LuxFire components are running ?\n%s'%(grp, err))
 		return []
 
+class DispatcherToken(object):
+	'''
+	Signed, short-lived tokens which prove to the Dispatcher that a call was
+	made on behalf of a logged in user. A token holds the user id, its expiry
+	time, a random nonce and a scope, signed with HMAC-SHA256 using the
+	dispatcher_secret shared by the web interface and the Dispatcher, so it
+	can be checked without a database query.
+	
+	A token without a scope is accepted once: the nonces of used tokens are
+	remembered in memory until the tokens expire. A token with a scope is
+	accepted for any number of calls in that scope until it expires, so that
+	an upload needs one token for all of its chunks.
+	'''
+	
+	_instance = None
+	
+	@classmethod
+	def Instance(cls):
+		if cls._instance == None:
+			cls._instance = cls()
+		return cls._instance
+	
+	def __init__(self):
+		cfg = LuxFireConfig.Instance()
+		self.secret = cfg.get('LuxFire', 'dispatcher_secret').encode('utf-8')
+		self.ttl = cfg.getint('LuxFire', 'dispatcher_token_ttl')
+		self.upload_ttl = cfg.getint('LuxFire', 'dispatcher_upload_token_ttl')
+		self.max_used = cfg.getint('LuxFire', 'dispatcher_token_cache')
+		
+		# OrderedDict of nonce: expiry of used tokens, in the order they were used
+		self.used = collections.OrderedDict()
+		self.used_lock = threading.Lock()
+	
+	@staticmethod
+	def upload_scope(jobname, filename):
+		'''
+		Scope of a token for the calls which upload one file of a job
+		'''
+		
+		return 'upload-%s' % hashlib.sha1(('%s/%s' % (jobname, filename)).encode('utf-8')).hexdigest()
+	
+	def signature(self, payload):
+		if not self.secret:
+			raise ClientException('No dispatcher_secret configured')
+		return hmac.new(self.secret, payload.encode('utf-8'), hashlib.sha256).hexdigest()
+	
+	def sign(self, user_id, scope=''):
+		'''
+		Make a token for a call on behalf of user_id, or for all the calls in
+		scope
+		'''
+		
+		nonce = hashlib.sha1(os.urandom(20)).hexdigest()
+		expiry = int(time.time()) + (self.upload_ttl if scope else self.ttl)
+		payload = '%i.%i.%s.%s' % (user_id, expiry, nonce, scope)
+		return '%s.%s' % (payload, self.signature(payload))
+	
+	def verify(self, user_id, token, scope=''):
+		'''
+		Check that token was made for user_id and scope, has not expired and,
+		if it has no scope, has not been used before. Returns True if the
+		token is valid.
+		'''
+		
+		try:
+			token_user_id, expiry, nonce, token_scope, signature = token.split('.')
+			expiry = int(expiry)
+			if int(token_user_id) != user_id or token_scope != scope:
+				return False
+		except (AttributeError, ValueError):
+			return False
+		
+		now = time.time()
+		if expiry < now:
+			return False
+		
+		expected = self.signature('%s.%i.%s.%s' % (token_user_id, expiry, nonce, token_scope))
+		if not hmac.compare_digest(expected, signature):
+			return False
+		
+		if scope:
+			return True
+		
+		with self.used_lock:
+			# Forget the nonces of tokens which have expired anyway
+			while len(self.used) > 0:
+				oldest_nonce, oldest_expiry = next(iter(self.used.items()))
+				if oldest_expiry >= now:
+					break
+				del self.used[oldest_nonce]
+			
+			if nonce in self.used or len(self.used) >= self.max_used:
+				return False
+			self.used[nonce] = expiry
+		
+		return True
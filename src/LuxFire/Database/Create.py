@@ -86,6 +86,11 @@ if __name__ == '__main__':
 	if options.bind:
 		LuxFireConfig.Instance().set('LuxFire', 'bind', options.bind)
 	
+	# The web interface and the Dispatcher sign user requests with this
+	if not LuxFireConfig.Instance().get('LuxFire', 'dispatcher_secret'):
+		import binascii, os
+		LuxFireConfig.Instance().set('LuxFire', 'dispatcher_secret', binascii.hexlify(os.urandom(32)).decode())
+	
 	# Update/create a default config file too
 	LuxFireLog('Creating/updating local config file...')
 	LuxFireConfig.Instance().Save()
@@ -97,6 +102,7 @@ if __name__ == '__main__':
 	from .Models.UserSession import UserSession	#@UnusedImport
 	from .Models.Queue import Queue	#@UnusedImport
 	from .Models.Result import Result	#@UnusedImport
+	from .Models.ResultCount import ResultCount	#@UnusedImport
 	
 	Database.CreateDatabase(options.verbose)
 	
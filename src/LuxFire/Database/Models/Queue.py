@@ -29,7 +29,7 @@ The Queue Model holds data about rendering jobs that are yet to be processed by
 LuxFire.Dispatcher.
 """
 
-from sqlalchemy import Column, DateTime, Enum, Integer, String, Sequence, Text, ForeignKey, UniqueConstraint #@UnresolvedImport
+from sqlalchemy import Column, DateTime, Enum, Index, Integer, String, Sequence, Text, ForeignKey, UniqueConstraint #@UnresolvedImport
 from sqlalchemy.orm import relationship, backref #@UnresolvedImport
 
 from .. import ModelBase
@@ -56,14 +56,42 @@ class Queue(ModelBase):
 	id = Column(Integer(12), Sequence('queue_id_seq'), primary_key=True)
 	haltspp = Column(Integer(8), default=-1)
 	halttime = Column(Integer(8), default=-1)
+	priority = Column(Integer(8), default=0, nullable=False)
 	path = Column(Text(), nullable=False)
 	jobname = Column(String(128), nullable=False)
 	date = Column(DateTime(), nullable=False)
 	status = Column(Enum(*QueueStatuses), nullable=False)
 	status_data = Column(Text(), nullable=True)
 	user_id = Column(Integer(12), ForeignKey('users.id'))
+	# The Dispatcher which currently handles this item, and until when
+	lease_holder = Column(String(128), nullable=True)
+	lease_expiry = Column(DateTime(), nullable=True)
 	
 	user = relationship("User", backref=backref('queue', order_by=id))
 	
 	def __repr__(self):
 		return "<Queue('%s','%s', %s:%s)>" % (self.user.email, self.jobname, self.status, self.status_data)
+
+# The DispatcherWorker selects candidate items per status, and per user within
+# the READY status, highest priority and oldest first
+Index('queue_schedule_idx',
+	Queue.__table__.c.status,
+	Queue.__table__.c.user_id,
+	Queue.__table__.c.priority,
+	Queue.__table__.c.date
+)
+
+# For the pages of Dispatcher.list_queue(), newest first
+Index('queue_user_list_idx',
+	Queue.__table__.c.user_id,
+	Queue.__table__.c.id
+)
+
+Index('queue_status_list_idx',
+	Queue.__table__.c.status,
+	Queue.__table__.c.id
+)
+
+Index('queue_lease_idx',
+	Queue.__table__.c.lease_holder
+)
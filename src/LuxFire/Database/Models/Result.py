@@ -29,7 +29,7 @@ The Result Model holds information about rendering jobs that have been processed
 by LuxFire.Dispatcher.
 """
 
-from sqlalchemy import Column, DateTime, Enum, Integer, String, Sequence, Text, ForeignKey
+from sqlalchemy import Column, DateTime, Enum, Index, Integer, String, Sequence, Text, ForeignKey
 from sqlalchemy.orm import relationship, backref
 
 from .. import ModelBase
@@ -53,7 +53,23 @@ class Result(ModelBase):
 	status = Column(Enum(*ResultStatuses), nullable=False)
 	user_id = Column(Integer(12), ForeignKey('users.id'))
 	
-	user = relationship(User, backref=backref('results', order_by=id))
+	# Users can have a great many Results, so only load them on request
+	user = relationship(User, backref=backref('results', order_by=id, lazy='dynamic'))
 	
 	def __repr__(self):
 		return "<Result('%s','%s')>" % (self.user.email, self.jobname)
+
+# For the pages of Dispatcher.list_results(), newest first
+Index('results_user_list_idx',
+	Result.__table__.c.user_id,
+	Result.__table__.c.id
+)
+
+Index('results_status_list_idx',
+	Result.__table__.c.status,
+	Result.__table__.c.id
+)
+
+Index('results_date_idx',
+	Result.__table__.c.date
+)
@@ -0,0 +1,49 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# LuxFire Distributed Rendering System
+# --------------------------------------------------------------------------
+#
+# Authors:
+# Doug Hammond
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENCE BLOCK *****
+#
+"""
+The ResultCount Model holds the number of archived Results per user and status,
+so that they can still be counted once their rows have left the results table.
+"""
+
+from sqlalchemy import Column, Enum, Integer, ForeignKey, UniqueConstraint
+
+from .. import ModelBase
+from .Result import ResultStatuses
+
+class ResultCount(ModelBase):
+	__tablename__ = 'result_counts'
+	__table_args__ = (
+		UniqueConstraint('user_id', 'status'),
+		{}
+	)
+	
+	user_id = Column(Integer(12), ForeignKey('users.id'), primary_key=True)
+	status = Column(Enum(*ResultStatuses), primary_key=True)
+	count = Column(Integer(12), default=0, nullable=False)
+	
+	def __repr__(self):
+		return "<ResultCount(%s, '%s', %i)>" % (self.user_id, self.status, self.count)
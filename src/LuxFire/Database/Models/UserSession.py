@@ -30,7 +30,7 @@ by LuxFire.Dispatcher.
 """
 import datetime
 
-from sqlalchemy import Column, DateTime, Integer, PickleType, Sequence, Text, ForeignKey
+from sqlalchemy import Boolean, Column, DateTime, Integer, Sequence, String, ForeignKey
 from sqlalchemy.orm import relationship, backref
 
 from .. import DatabaseSession, ModelBase
@@ -40,16 +40,16 @@ class UserSession(ModelBase):
 	__tablename__ = 'user_sessions'
 	
 	id = Column(Integer(12), Sequence('user_sessions_id_seq'), primary_key=True)
-	sess_id = Column(Text(32))
+	sess_id = Column(String(32), index=True)
 	user_id = Column(Integer(12), ForeignKey('users.id'))
 	expiry = Column(DateTime(), nullable=False)
-	session_data = Column(PickleType())
+	logged_in = Column(Boolean(), default=False, nullable=False)
 	
 	user = relationship(User, backref=backref('user_sessions', order_by=id))
 	
 	def __repr__(self):
 		if self.user:
-			return "<UserSession('%s'(%s))>" % (self.user.email, len(self.session_data))
+			return "<UserSession('%s'(%s))>" % (self.user.email, self.logged_in)
 		else:
 			return "<UserSession()>"
 	
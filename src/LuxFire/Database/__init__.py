@@ -27,15 +27,32 @@
 """
 LuxFire.Database manages the database connection for persistent data storage.
 """
-import threading
+import threading, time
 
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.interfaces import PoolListener
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 ModelBase = declarative_base()
 
 from .. import LuxFireConfig
 
+class SQLiteSetup(PoolListener):
+	"""
+	Configure each new SQLite connection: write-ahead logging lets readers
+	carry on while another connection writes, and the busy timeout makes a
+	connection wait for a lock instead of failing straight away.
+	"""
+	def __init__(self, busy_timeout):
+		self.busy_timeout = busy_timeout
+	
+	def connect(self, dbapi_con, con_record):
+		cursor = dbapi_con.cursor()
+		cursor.execute('PRAGMA journal_mode=WAL')
+		cursor.execute('PRAGMA busy_timeout=%i' % (self.busy_timeout * 1000))
+		cursor.close()
+
 class Database(object):
 	_instance = None
 	_sessionmaker = None
@@ -49,9 +66,14 @@ class Database(object):
 	@classmethod
 	def Instance(cls, new=False):
 		if cls._instance == None or new:
-			cls._instance = create_engine(
-				LuxFireConfig.Instance().get('LuxFire', 'database'),
-			)
+			cfg = LuxFireConfig.Instance()
+			url = cfg.get('LuxFire', 'database')
+			kwargs = {}
+			if url.startswith('sqlite'):
+				busy_timeout = cfg.getfloat('LuxFire', 'database_busy_timeout')
+				kwargs['connect_args'] = {'timeout': busy_timeout}
+				kwargs['listeners'] = [SQLiteSetup(busy_timeout)]
+			cls._instance = create_engine(url, **kwargs)
 			
 		return cls._instance
 	
@@ -66,14 +88,52 @@ class Database(object):
 		
 		return cls._sessionmaker()
 
-# Convenience contextmanager type session
 class DatabaseSession(object):
+	"""
+	Context manager for a database session. By default every flush is its
+	own transaction; with transaction=True all changes made in the block are
+	committed together when it ends, or rolled back if it raises.
+	"""
 	db = None
+	def __init__(self, transaction=False):
+		self.transaction = transaction
 	def __enter__(self):
 		#Log('Got DB Session')
 		self.db = Database.Session()
+		if self.transaction:
+			self.db.begin()
 		return self.db
 	def __exit__(self, exc_type, exc_val, exc_tb):
-		self.db.flush()
-		self.db.close()
+		try:
+			if not self.transaction:
+				self.db.flush()
+			elif exc_type is None:
+				self.db.commit()
+			else:
+				self.db.rollback()
+		finally:
+			self.db.close()
 		#Log('Release DB Session')
+
+def is_locked_error(err):
+	return 'database is locked' in str(err) or 'database is busy' in str(err)
+
+def DatabaseTransaction(func, *args):
+	"""
+	Call func(db, *args) in a DatabaseSession transaction and return its
+	result. If the database is locked by another connection, the whole
+	transaction is tried again a few times with increasing delays, so func
+	should not have side effects outside of the database.
+	"""
+	retries = LuxFireConfig.Instance().getint('LuxFire', 'database_retries')
+	delay = 0.1
+	while True:
+		try:
+			with DatabaseSession(transaction=True) as db:
+				return func(db, *args)
+		except OperationalError as err:
+			if retries < 1 or not is_locked_error(err):
+				raise
+			retries -= 1
+			time.sleep(delay)
+			delay *= 2
@@ -0,0 +1,139 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# LuxFire Distributed Rendering System
+# --------------------------------------------------------------------------
+#
+# Authors:
+# Doug Hammond
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENCE BLOCK *****
+#
+"""
+Dispatcher.Archive moves old Results out of the database into compressed files.
+
+The archive is partitioned by month: each batch of archived Results is written
+to a gzipped file of JSON lines in a directory named after the month of their
+date. The number of archived Results per user and status is kept in the
+ResultCount table.
+"""
+
+import gzip, json, os, threading
+
+from ..Database import DatabaseTransaction
+from ..Database.Models.Result import Result
+from ..Database.Models.ResultCount import ResultCount
+
+class ResultArchive(object):
+	
+	# Number of Results moved in one transaction
+	batch_size = 1000
+	
+	#@class var
+	path_create_lock = threading.Lock()
+	
+	def __init__(self, path):
+		self.path = path
+	
+	def archive(self, before):
+		"""
+		Move all Results dated before the given datetime into the archive.
+		Returns the number of Results archived.
+		"""
+		total = 0
+		while True:
+			archived = DatabaseTransaction(self.archive_batch, before)
+			total += archived
+			if archived < self.batch_size:
+				return total
+	
+	def archive_batch(self, db, before):
+		"""
+		Move the oldest batch of Results dated before the given datetime into
+		the archive, in the transaction of db. The files are written before
+		the rows are deleted, and are named by the ids they hold, so doing a
+		batch again after a rollback just rewrites the same files.
+		"""
+		results = db.query(Result).filter(Result.date<before).order_by(Result.id).limit(self.batch_size).all()
+		if len(results) == 0:
+			return 0
+		
+		partitions = {}
+		counts = {}
+		for ri in results:
+			partitions.setdefault(ri.date.strftime('%Y-%m'), []).append(ri)
+			key = (ri.user_id, ri.status)
+			counts[key] = counts.get(key, 0) + 1
+		
+		for month, month_results in partitions.items():
+			self.write(month, month_results)
+		
+		ids = [ri.id for ri in results]
+		deleted = db.query(Result).filter(Result.id.in_(ids)).delete(synchronize_session=False)
+		if deleted != len(ids):
+			# Another Dispatcher is archiving the same Results
+			raise Exception('Results archived concurrently, %i of %i left' % (deleted, len(ids)))
+		
+		for (user_id, status), count in counts.items():
+			rc = db.query(ResultCount).get((user_id, status))
+			if rc is None:
+				rc = ResultCount(user_id=user_id, status=status, count=0)
+				db.add(rc)
+			rc.count += count
+		
+		return len(results)
+	
+	def write(self, month, results):
+		"""Write Results to a new file in the partition of month"""
+		month_path = os.path.join(self.path, month)
+		with ResultArchive.path_create_lock:
+			if not os.path.exists(month_path):
+				os.makedirs(month_path)
+		
+		file_path = os.path.join(month_path, '%010i-%010i.jsonl.gz' % (results[0].id, results[-1].id))
+		temp_path = '%s.%x.tmp' % (file_path, threading.current_thread().ident)
+		with gzip.open(temp_path, 'wb') as f:
+			for ri in results:
+				f.write( (json.dumps({
+					'id': ri.id,
+					'date': ri.date.isoformat(),
+					'user_id': ri.user_id,
+					'jobname': ri.jobname,
+					'path': ri.path,
+					'status': ri.status,
+				}) + '\n').encode('utf-8') )
+		
+		if os.path.exists(file_path):
+			os.remove(file_path)
+		os.rename(temp_path, file_path)
+	
+	def months(self):
+		"""The months which have archived Results, oldest first"""
+		if not os.path.exists(self.path):
+			return []
+		return sorted(os.listdir(self.path))
+	
+	def read(self, month):
+		"""Iterate over the archived Results of month, as dicts"""
+		month_path = os.path.join(self.path, month)
+		for file_name in sorted(os.listdir(month_path)):
+			if not file_name.endswith('.jsonl.gz'):
+				continue
+			with gzip.open(os.path.join(month_path, file_name), 'rb') as f:
+				for line in f:
+					yield json.loads(line.decode('utf-8'))
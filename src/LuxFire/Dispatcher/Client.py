@@ -30,6 +30,17 @@ Dispatcher.Client provides access to existing remote Dispatcher.Servers.
 
 from ..Client import ListLuxFireGroup, ServerLocator, ClientException
 
+# Columns of the rows returned by Dispatcher.list_queue() and list_results()
+QueueListColumns = ('id', 'date', 'email', 'jobname', 'path', 'priority', 'haltspp', 'halttime', 'status', 'status_data')
+ResultListColumns = ('id', 'date', 'email', 'jobname', 'path', 'status')
+
+def ListRows(columns, rows):
+	'''
+	Turn rows returned by Dispatcher.list_queue() or list_results() into
+	dicts of column: value, for use in templates
+	'''
+	return [dict(zip(columns, row)) for row in rows]
+
 def DispatcherGroup():
 	LuxSlavesNames = ListLuxFireGroup('Dispatcher')
 	slaves = {}
@@ -38,9 +49,14 @@ def DispatcherGroup():
 		for LN in LuxSlavesNames:
 			try:
 				RS = ServerLocator.Instance().get_by_name(LN)
+				# Uploaded scene data is worth compressing; incompressible
+				# chunks make the proxy back off by itself
+				RS._pyroCompression.methods['add_file_chunk'] = True
+				RS._pyroCompression.methods['add_file'] = True
 				slaves[LN] = RS
-				break	# Only return the first dispatcher
+				break	# Only return the first dispatcher, they all share one Queue
 			except Exception as err:
+				ServerLocator.Instance().forget(LN)
 				raise ClientException('Error with remote dispatcher %s: %s' % (LN, err))
 		
 	else:
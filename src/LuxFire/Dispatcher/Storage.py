@@ -0,0 +1,111 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# LuxFire Distributed Rendering System
+# --------------------------------------------------------------------------
+#
+# Authors:
+# Doug Hammond
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENCE BLOCK *****
+#
+"""
+Dispatcher.Storage is a content addressed file store in NetworkStorage.
+
+Every file distributed to NetworkStorage is stored once as a read-only blob,
+named by the SHA1 hash of its content. Queue item directories are built from
+hard links to these blobs, so resubmitting a scene only copies the files which
+have actually changed.
+"""
+
+import hashlib, os, shutil, stat, threading
+
+class ContentStore(object):
+	
+	# Size of the blocks read when hashing files
+	block_size = 1024*1024
+	
+	#@class var
+	blob_create_lock = threading.Lock()
+	
+	def __init__(self, root):
+		self.root = root
+	
+	def hash_file(self, path):
+		"""Return the SHA1 hex digest of the content of the file at path"""
+		h = hashlib.sha1()
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(self.block_size), b''):
+				h.update(block)
+		return h.hexdigest()
+	
+	def blob_path(self, digest):
+		return os.path.join(self.root, digest[:2], digest[2:])
+	
+	def add(self, path):
+		"""
+		Add the file at path to the store, if its content is not already in
+		there. Returns (blob path, True if the blob was newly copied).
+		"""
+		blob = self.blob_path( self.hash_file(path) )
+		if os.path.exists(blob):
+			return blob, False
+		
+		blob_dir = os.path.dirname(blob)
+		with ContentStore.blob_create_lock:
+			if not os.path.exists(blob_dir):
+				os.makedirs(blob_dir)
+		
+		# Copy to a temporary name first, so that an interrupted copy never
+		# leaves a truncated blob behind
+		tmp = '%s.%i.%i.tmp' % (blob, os.getpid(), threading.current_thread().ident)
+		shutil.copyfile(path, tmp)
+		os.chmod(tmp, stat.S_IRUSR|stat.S_IRGRP|stat.S_IROTH)
+		if os.path.exists(blob):
+			# Another thread added the same content in the meantime
+			os.remove(tmp)
+			return blob, False
+		os.rename(tmp, blob)
+		return blob, True
+	
+	def link(self, blob, dest):
+		"""Hard link blob to dest, falling back to a copy if that fails"""
+		try:
+			os.link(blob, dest)
+		except (AttributeError, OSError):
+			# No hard link support on this platform or across these filesystems
+			shutil.copyfile(blob, dest)
+	
+	def build_tree(self, in_path, out_path):
+		"""
+		Recreate the directory in_path at out_path, which must not exist,
+		from blobs in the store. Returns (files linked, blobs copied).
+		"""
+		linked = 0
+		copied = 0
+		for dirpath, dirnames, filenames in os.walk(in_path):	#@UnusedVariable
+			target_dir = os.path.join(out_path, os.path.relpath(dirpath, in_path))
+			if not os.path.exists(target_dir):
+				os.makedirs(target_dir)
+			for filename in filenames:
+				blob, new = self.add( os.path.join(dirpath, filename) )
+				self.link(blob, os.path.join(target_dir, filename))
+				linked += 1
+				if new: copied += 1
+		
+		return linked, copied
@@ -28,26 +28,213 @@
 Dispatcher is a Render Queue/Job manager and dispatcher for Renderer.Servers.
 """
 
-import datetime, glob, os, shutil, threading, time
-from sqlalchemy.sql.expression import desc #@UnresolvedImport
-from sqlalchemy.orm import eagerload #@UnresolvedImport
+import datetime, glob, hashlib, math, os, re, shutil, subprocess, threading, time
+from sqlalchemy.sql.expression import and_, desc, func, or_ #@UnresolvedImport
+from sqlalchemy.orm import object_session #@UnresolvedImport
 
 from LuxRender import LuxLog, TimerThread
-import Pyro.errors
+import Pyro.core, Pyro.errors
 
 from .. import LuxFireConfig, clean_file_name
-from ..Client import ClientException
-from ..Database import Database, DatabaseSession
+from ..Client import ClientException, DispatcherToken
+from ..Database import Database, DatabaseSession, DatabaseTransaction
 from ..Database.Models.Queue import Queue
 from ..Database.Models.Result import Result
-from ..Database.Models.UserSession import UserSession
-from ..Renderer.Client import RendererGroup
-from ..Server import ServerObject, ServerObjectThread
+from ..Database.Models.ResultCount import ResultCount
+from ..Database.Models.User import User
+from ..Renderer.Client import RendererGroup, RendererRegistry
+from ..Server import ServerObject, ServerObjectThread, WorkerPool
+from .Client import QueueListColumns, ResultListColumns
+from .Archive import ResultArchive
+from .Storage import ContentStore
 
 def DispatcherLog(message):
 	LuxLog(message, module_name='LuxFire.Dispatcher')
 
-class DispatcherDistributor(ServerObjectThread):
+def move_to_results(qi, status='RENDER_COMPLETE'):
+	"""Move a finished Queue item into the Results table"""
+	
+	db = object_session(qi)
+	ri = Result()
+	ri.date = datetime.datetime.now()
+	ri.jobname = qi.jobname
+	ri.path = qi.path
+	ri.status = status
+	ri.user_id = qi.user_id
+	db.add(ri)
+	db.delete(qi)
+
+def set_status(db, qi_id, status, status_data):
+	"""Change the status of a Queue item, for use with DatabaseTransaction"""
+	qi = db.query(Queue).filter(Queue.id==qi_id).one()
+	qi.status = status
+	qi.status_data = status_data
+
+# The Renderer.Servers of a RENDERING item are listed in its status_data, those
+# whose start_server() job has not confirmed the start yet with this prefix
+STARTING = 'starting:'
+
+# status_data of a RENDERING item whose partial films are being merged
+MERGING = 'merging'
+
+def film_part_name(scene_file, part):
+	"""
+	Film name (without extension) used by one of the servers of a split item,
+	for its partial film and its image outputs
+	"""
+	return '%s.part%02i' % (os.path.splitext(scene_file)[0], part)
+
+def film_parts(qi):
+	"""The partial films of a split Queue item in NetworkStorage"""
+	cfg = LuxFireConfig.Instance()
+	if cfg.get('NetworkStorage', 'type') != 'mounted_filesystem':
+		return []
+	
+	net_path = os.path.join( cfg.NetworkStorage(), qi.path )
+	return sorted( glob.glob( os.path.join(net_path, '*.part[0-9][0-9].flm') ) )
+
+def merge_film_parts(qi):
+	"""
+	Merge the partial films of a split Queue item into a single film next to
+	the scene in NetworkStorage, using the configured film_merger, and write
+	the merged film's images with film_tonemapper. The partial films and
+	their images are then removed. Does nothing if the item has no partial
+	films.
+	"""
+	parts = film_parts(qi)
+	if len(parts) == 0:
+		return
+	
+	cfg = LuxFireConfig.Instance()
+	film = re.sub(r'\.part[0-9]+\.flm$', '.flm', parts[0])
+	if subprocess.call([cfg.get('Dispatcher', 'film_merger'), '-o', film] + parts) != 0:
+		raise Exception('%s failed' % cfg.get('Dispatcher', 'film_merger'))
+	
+	if subprocess.call([cfg.get('Dispatcher', 'film_tonemapper'), film], cwd=os.path.dirname(film)) != 0:
+		raise Exception('%s failed' % cfg.get('Dispatcher', 'film_tonemapper'))
+	
+	for part in parts:
+		for part_file in glob.glob( '%s.*' % os.path.splitext(part)[0] ):
+			os.remove(part_file)
+
+def renderer_finished(qi, renderer_name):
+	"""
+	Remove renderer_name from the servers rendering a Queue item. When none
+	are left, mark it RENDER_COMPLETE, for store_item() to move to the Results
+	table, or MERGING if it was split. Whoever stores MERGING then has to
+	merge the partial films with DispatcherWorker.merge_films(); the films
+	are not touched before, so that only one thread merges them. Makes no
+	database changes, so that it can be used outside of a transaction.
+	Returns True if no server is rendering the item any more.
+	"""
+	renderers = qi.status_data.split(',')
+	for name in (renderer_name, STARTING + renderer_name):
+		if name in renderers:
+			renderers.remove(name)
+	
+	if len(renderers) > 0:
+		qi.status_data = ','.join(renderers)
+		return False
+	
+	if len(film_parts(qi)) > 0:
+		qi.status_data = MERGING
+		return True
+	
+	qi.status = 'RENDER_COMPLETE'
+	qi.status_data = ''
+	return True
+
+def detach_items(db, items):
+	"""
+	Remove Queue items and their users from db, so that they can still be
+	read once its transaction has ended
+	"""
+	for obj in set([qi.user for qi in items]) | set(items):
+		if obj in db:
+			db.expunge(obj)
+	return items
+
+def fetch_item(db, qi_id, status):
+	"""
+	The Queue item qi_id detached from db, or None if it does not have the
+	given status. For use with DatabaseTransaction.
+	"""
+	qi = db.query(Queue).filter(Queue.id==qi_id).filter(Queue.status==status).first()
+	if qi is None:
+		return None
+	return detach_items(db, [qi])[0]
+
+def store_item(db, qi_id, status, status_data, new_status, new_status_data):
+	"""
+	Write the outcome of handling a Queue item outside of a transaction, for
+	use with DatabaseTransaction. status and status_data are those which the
+	item was handled with; if the item has changed since (it was aborted, or
+	another Renderer.Server finished meanwhile) nothing is written and False
+	is returned. RENDER_COMPLETE items are moved to the Results table.
+	"""
+	qi = db.query(Queue).filter(Queue.id==qi_id).filter(Queue.status==status) \
+		.filter(Queue.status_data==status_data).first()
+	if qi is None:
+		return False
+	if new_status == 'RENDER_COMPLETE':
+		move_to_results(qi)
+	else:
+		qi.status = new_status
+		qi.status_data = new_status_data
+	return True
+
+def starting_renderers(db):
+	"""
+	Names of the Renderer.Servers whose start on a RENDERING item has not been
+	confirmed yet, for use with DatabaseTransaction
+	"""
+	names = set()
+	for (status_data,) in db.query(Queue.status_data).filter(Queue.status=='RENDERING').all():
+		for name in status_data.split(','):
+			if name.startswith(STARTING):
+				names.add(name[len(STARTING):])
+	return names
+
+def confirm_start(db, qi_id, renderer_name):
+	"""
+	Mark the start of renderer_name on a RENDERING item as confirmed, for use
+	with DatabaseTransaction. Returns False if the item is no longer waiting
+	for it (e.g. it was aborted).
+	"""
+	qi = db.query(Queue).filter(Queue.id==qi_id).filter(Queue.status=='RENDERING').first()
+	if qi is None:
+		return False
+	renderers = qi.status_data.split(',')
+	if STARTING + renderer_name not in renderers:
+		return False
+	renderers[renderers.index(STARTING + renderer_name)] = renderer_name
+	qi.status_data = ','.join(renderers)
+	return True
+
+def fail_item(db, qi_id, status, message):
+	"""
+	Change a Queue item to ERROR if it still has the given status, for use
+	with DatabaseTransaction
+	"""
+	qi = db.query(Queue).filter(Queue.id==qi_id).filter(Queue.status==status).first()
+	if qi is not None:
+		qi.status = 'ERROR'
+		qi.status_data = message
+
+def dir_size(path):
+	"""Total size in bytes of the files in path"""
+	size = 0
+	for dirpath, dirnames, filenames in os.walk(path):	#@UnusedVariable
+		for filename in filenames:
+			size += os.path.getsize( os.path.join(dirpath, filename) )
+	return size
+
+class DispatcherDistributor(ServerObject):
+	"""
+	Copies a Queue item's data to NetworkStorage. run() is submitted as a job
+	to the DispatcherTimer's distribute_pool.
+	"""
+	
 	_Service_Type = 'DispatcherDistributor'
 	
 	qi_id = None
@@ -59,70 +246,107 @@ class DispatcherDistributor(ServerObjectThread):
 		return '<DispatcherDistributor %s>' % self.qi_id
 	
 	def run(self):
+		# Don't keep a session open whilst copying, only the status change
+		# at the end needs to write to the database
 		with DatabaseSession() as db:
-			
 			qi = db.query(Queue).filter(Queue.id==self.qi_id).one()
+			qi_path = qi.path
+			user_id = qi.user.id
+		
+		cfg = LuxFireConfig.Instance()
+		
+		self.dbo('Distributing data')
+		
+		try:
+			# At this point in time, qi.path is located in LocalStorage
+			in_path = os.path.realpath( os.path.join( cfg.LocalStorage(), qi_path ) )
+			if not os.path.exists( in_path ):
+				raise Exception('Data not found for this item!')
 			
-			cfg = LuxFireConfig.Instance()
+			lxs_files = glob.glob( os.path.join(in_path, '*.lxs') )
+			if len(lxs_files) == 0:
+				raise Exception('No LXS file found in LocalStorage path %s' % in_path)
 			
-			self.dbo('Distributing data')
+			self.dbo('in_path = "%s"' % in_path)
 			
-			try:
-				# At this point in time, qi.path is located in LocalStorage
-				in_path = os.path.realpath( os.path.join( cfg.LocalStorage(), qi.path ) )
-				if not os.path.exists( in_path ):
-					raise Exception('Data not found for this item!')
+			# TODO: this copy mechanism will need to be swapped out depending
+			# on the network storage technology used; eg. for cloud storage etc
+			
+			if cfg.get('NetworkStorage', 'type') == 'mounted_filesystem':
+				if not os.path.exists( cfg.NetworkStorage() ):
+					raise Exception('Network data path not valid!')
 				
-				lxs_files = glob.glob( os.path.join(in_path, '*.lxs') )
-				if len(lxs_files) == 0:
-					raise Exception('No LXS file found in LocalStorage path %s' % in_path)
+				out_path = os.path.join( cfg.NetworkStorage(), qi_path )
+				self.dbo('out_path = "%s"' % out_path)
 				
-				self.dbo('in_path = "%s"' % in_path)
+				# if writing to NetworkStorage is going to fail, lets find out here first
+				network_user_dir = os.path.join( cfg.NetworkStorage(), '%i'%user_id )
 				
-				# TODO: this copy mechanism will need to be swapped out depending
-				# on the network storage technology used; eg. for cloud storage etc
+				# Using a lock here prevents thread race in makedirs()
+				with DispatcherDistributor.path_create_lock:
+					if not os.path.exists( network_user_dir ):
+						os.makedirs(network_user_dir)
 				
-				if cfg.get('NetworkStorage', 'type') == 'mounted_filesystem':
-					if not os.path.exists( cfg.NetworkStorage() ):
-						raise Exception('Network data path not valid!')
-					
-					out_path = os.path.join( cfg.NetworkStorage(), qi.path )
-					self.dbo('out_path = "%s"' % out_path)
-					
-					# if writing to NetworkStorage is going to fail, lets find out here first
-					network_user_dir = os.path.join( cfg.NetworkStorage(), '%i'%qi.user.id )
-					
-					# Using a lock here prevents thread race in makedirs()
-					with DispatcherDistributor.path_create_lock:
-						if not os.path.exists( network_user_dir ):
-							os.makedirs(network_user_dir)
-					
-					if os.path.exists( out_path ):
-						# copytree doesn't like the destination to exist, raise a
-						# warning and remove it first
-						self.log('Target path exists, removing and re-copying')
-						shutil.rmtree( out_path )
-					
-					shutil.copytree(in_path, out_path)
+				if os.path.exists( out_path ):
+					# copytree doesn't like the destination to exist, raise a
+					# warning and remove it first
+					self.log('Target path exists, removing and re-copying')
+					shutil.rmtree( out_path )
 				
-				qi.status_data = os.path.basename(lxs_files[0])
+				if cfg.getboolean('NetworkStorage', 'content_store'):
+					store = ContentStore( os.path.join(cfg.NetworkStorage(), '.store') )
+					linked, copied = store.build_tree(in_path, out_path)
+					self.dbo('Linked %i files, copied %i new' % (linked, copied))
+				else:
+					shutil.copytree(in_path, out_path)
 			
-				# Now self.qi.path refers to a scene file in NetworkStorage
-				qi.status = 'READY'
-				self.dbo('Data ready')
-				
-			except Exception as err:
-				self.log('Data copy failed: %s' % err)
-				qi.status = 'ERROR'
-				qi.status_data = '%s'%err
+			# Now qi.path refers to a scene file in NetworkStorage
+			DatabaseTransaction(set_status, self.qi_id, 'READY', os.path.basename(lxs_files[0]))
+			self.dbo('Data ready')
+			
+		except Exception as err:
+			self.log('Data copy failed: %s' % err)
+			DatabaseTransaction(set_status, self.qi_id, 'ERROR', '%s'%err)
+	
+		# The item is now either READY or ERROR
+		DispatcherTimer.wake()
 
 class DispatcherWorker(ServerObjectThread):
 	_Service_Type = 'DispatcherWorker'
 	
 	renderer_servers = None
 	
-	_render_start_threads = []
-	_distributor_threads = []
+	# Name of the Dispatcher which Renderer.Servers should notify
+	dispatcher_name = None
+	
+	# Number of items of the current status still to be processed after the
+	# current one
+	items_remaining = 0
+	
+	# WorkerPools shared by all DispatcherWorkers, set by the DispatcherTimer
+	distribute_pool = None
+	render_start_pool = None
+	
+	# (pool, func, args, size) jobs to submit once the current status'
+	# changes have been flushed to the database
+	_pending_jobs = None
+	
+	# Renderer.Servers which must not be given another item in this pass,
+	# because their start on a RENDERING item is not confirmed yet
+	unconfirmed_renderers = None
+	
+	# (name, RC, proxy) of the idle Renderer.Servers not yet given an item in
+	# this pass, found once per pass by idle_renderers()
+	_idle_renderers = None
+	
+	# (qi_id, renderer name) of the start_server() jobs of this process
+	# which have not finished yet
+	starting = set()
+	starting_lock = threading.Lock()
+	
+	# Ids of the items whose films are being merged in this process
+	merging = set()
+	merging_lock = threading.Lock()
 	
 	def __repr__(self):
 		return '<DispatcherWorker>'
@@ -141,7 +365,8 @@ class DispatcherWorker(ServerObjectThread):
 			'PENDING':		self.handler_PENDING,
 			
 			# item is being handled by a DispatcherDistributor, no action needed
-			'DISTRIBUTING': self.handler_NULL,
+			# unless the Dispatcher distributing it has gone away
+			'DISTRIBUTING': self.handler_DISTRIBUTING,
 			
 			# item ready for rendering
 			'READY':		self.handler_READY,
@@ -159,225 +384,651 @@ class DispatcherWorker(ServerObjectThread):
 			# work!
 			self.renderer_servers = RendererGroup()
 		except (ClientException, Pyro.errors.PyroError) as err:
-			self.renderer_servers = {}
+			self.renderer_servers = None
 			self.log('Cannot Dispatch any new work: %s' % err)
-			# return # don't abort, we can still process/distribute some Queue items
+			# don't abort, we can still process/distribute some Queue items
 		
-		with DatabaseSession() as db:
-			
-			limit = LuxFireConfig.Instance().getint('Dispatcher', 'max_items_per_worker')
-			
-			# TODO: limit = min( len(self.renderer_servers), limit ) ?
-			
-			# Only grab a few records at a time
-			self.dbo('Fetching %i items' % limit)
-			aqi = db.query(Queue).order_by(Queue.date).limit(limit).all()
-			
-			self.dbo('Processing RENDERING items:')
-			# Process the RENDERING items first, so that we can free up Renderer.Servers
-			# Doing this separately is actually essential for proper resuming of Dispatcher
-			# if it gets interrupted
-			for rqi in aqi:
-				if rqi.status != 'RENDERING': continue
-				self.dbo(' %s' % rqi)
-				status_handlers[rqi.status](rqi)
-			
-			db.flush()
-			
-			self.dbo('Processing OTHER items:')
-			# Order by Queue.date ensures oldest items are rendered first
-			for oqi in aqi:
-				if oqi.status == 'RENDERING': continue
-				self.dbo(' %s' % oqi)
-				status_handlers[oqi.status](oqi)
-			
-			db.flush()
-			
-			# Now we can safely wait for child threads to complete
-			for rst in self._render_start_threads:
-				if rst.is_alive():
-					rst.join()
-			for ddt in self._distributor_threads:
-				if ddt.is_alive():
-					ddt.join()
+		limit = LuxFireConfig.Instance().getint('Dispatcher', 'max_items_per_worker')
+		
+		# Keep the items this Dispatcher is handling for another lease_ttl
+		DatabaseTransaction(self.renew_leases)
+		
+		self.unconfirmed_renderers = DatabaseTransaction(starting_renderers)
+		self._idle_renderers = None
+		
+		# Only the actionable statuses are fetched, each one separately, so
+		# that items which need no action cannot hold up those which do.
+		# RENDERING items are processed first, so that we can free up
+		# Renderer.Servers. Doing this separately is actually essential for
+		# proper resuming of Dispatcher if it gets interrupted.
+		# Without the list of Renderer.Servers, a RENDERING item's server
+		# can't be told apart from one which has gone away, and READY items
+		# can't be started, so those are left for the next pass
+		if self.renderer_servers is None:
+			statuses = ('DISTRIBUTING', 'PENDING')
+		else:
+			statuses = ('RENDERING', 'DISTRIBUTING', 'PENDING', 'READY')
+		for status in statuses:
+			self.dbo('Processing %s items:' % status)
+			self.process_status(status, status_handlers, limit)
+		
+		self.dbo('Finished')
+	
+	def process_status(self, status, status_handlers, limit):
+		"""
+		Handle the Queue items with the given status. The items are claimed
+		in one short transaction and handled outside of any transaction, so
+		that no database lock is held across the remote calls and film merges
+		of the handlers. Their outcome is then written back in a second short
+		transaction, and the jobs of the items which were written back are
+		submitted to their pools.
+		"""
+		items = DatabaseTransaction(self.claim_items, status, limit)
+		self.items_remaining = len(items)
+		self._pending_jobs = []
+		outcomes = []
+		for qi in items:
+			self.items_remaining -= 1
+			self.dbo(' %s' % qi)
+			handled_with = (qi.status, qi.status_data)
+			first_job = len(self._pending_jobs)
+			status_handlers[qi.status](qi)
+			outcomes.append( (qi, handled_with, self._pending_jobs[first_job:]) )
+		
+		stored = DatabaseTransaction(self.store_outcomes, outcomes)
+		
+		# The jobs update the items in their own sessions, so they may only
+		# start once the status changes above are committed
+		for qi, handled_with, item_jobs in outcomes:
+			if qi.id in stored:
+				self.submit_jobs(qi, handled_with, item_jobs)
+	
+	def submit_jobs(self, qi, handled_with, jobs):
+		"""
+		Submit the jobs of an item to their pools. The jobs are left to the
+		pools and never waited for here, so that a slow copy or render start
+		cannot hold up the next pass. If a pool refuses the first job, the
+		item goes back to the status it was handled with; if it refuses a
+		later one, some of the item's jobs are running already and the item
+		is set to ERROR instead.
+		"""
+		for submitted, (pool, func, args, size) in enumerate(jobs):
+			if func == self.start_server:
+				with self.starting_lock:
+					self.starting.add( (qi.id, args[0]) )
+			elif func == self.merge_films:
+				with self.merging_lock:
+					self.merging.add(qi.id)
+			if pool.submit(func, args, size):
+				continue
 			
-			self.dbo('Finished')
+			if func == self.start_server:
+				with self.starting_lock:
+					self.starting.discard( (qi.id, args[0]) )
+			elif func == self.merge_films:
+				with self.merging_lock:
+					self.merging.discard(qi.id)
+			self.log('Job queue full, cannot start work on %s' % qi)
+			status, status_data = handled_with
+			if submitted == 0:
+				DatabaseTransaction(store_item, qi.id, qi.status, qi.status_data, status, status_data)
+			else:
+				DatabaseTransaction(fail_item, qi.id, qi.status, 'Too much work queued, could not start all of it')
+			break
+	
+	def claim_items(self, db, status, limit):
+		"""
+		Fetch the Queue items with the given status and take their leases.
+		Items which another Dispatcher got first are left out. The items are
+		detached from db, to be handled after its transaction has ended.
+		"""
+		return detach_items(db, [qi for qi in self.fetch_items(db, status, limit) if self.claim(db, qi)])
+	
+	def store_outcomes(self, db, outcomes):
+		"""
+		Write back the (qi, handled_with, jobs) outcomes of process_status()
+		and return the ids of the items which were changed
+		"""
+		stored = set()
+		for qi, (status, status_data), item_jobs in outcomes:	#@UnusedVariable
+			if (qi.status, qi.status_data) == (status, status_data):
+				if status in ('PENDING', 'READY'):
+					# Deferred, let any Dispatcher have a go next time
+					self.release(db, qi)
+			elif store_item(db, qi.id, status, status_data, qi.status, qi.status_data):
+				stored.add(qi.id)
+		return stored
+	
+	def lease_expiry(self):
+		return datetime.datetime.now() + datetime.timedelta(
+			seconds=LuxFireConfig.Instance().getint('Dispatcher', 'lease_ttl')
+		)
+	
+	def claimable(self):
+		"""
+		Criterion for the Queue items this Dispatcher may handle: those which
+		it already holds the lease of, or whose lease is free or has expired
+		"""
+		return or_(
+			Queue.lease_holder==None,
+			Queue.lease_holder==self.dispatcher_name,
+			Queue.lease_expiry<datetime.datetime.now()
+		)
+	
+	def claim(self, db, qi):
+		"""
+		Take the lease of a Queue item, unless another Dispatcher holds it or
+		the item has changed status since it was fetched. This is a single
+		conditional UPDATE, so only one Dispatcher can succeed at a time.
+		Returns True if this Dispatcher now holds the lease.
+		"""
+		claimed = db.query(Queue).filter(Queue.id==qi.id).filter(Queue.status==qi.status) \
+			.filter(self.claimable()) \
+			.update({
+				'lease_holder': self.dispatcher_name,
+				'lease_expiry': self.lease_expiry()
+			}, synchronize_session=False)
+		return claimed == 1
+	
+	def release(self, db, qi):
+		"""Give up the lease of a Queue item"""
+		db.query(Queue).filter(Queue.id==qi.id).filter(Queue.lease_holder==self.dispatcher_name) \
+			.update({
+				'lease_holder': None,
+				'lease_expiry': None
+			}, synchronize_session=False)
+	
+	def renew_leases(self, db):
+		"""Extend the leases of all Queue items held by this Dispatcher"""
+		db.query(Queue).filter(Queue.lease_holder==self.dispatcher_name) \
+			.update({'lease_expiry': self.lease_expiry()}, synchronize_session=False)
+	
+	def fetch_items(self, db, status, limit):
+		"""
+		Fetch the Queue items with the given status which this Dispatcher may
+		handle, in the order in which they should be processed.
+		"""
+		if status == 'RENDERING':
+			# Limited only by the number of Renderer.Servers
+			return db.query(Queue).filter(Queue.status==status).filter(self.claimable()).all()
+		
+		if status == 'DISTRIBUTING':
+			# Only those left behind by a Dispatcher which has gone away
+			return db.query(Queue).filter(Queue.status==status) \
+				.filter(or_(
+					Queue.lease_holder==None,
+					and_(Queue.lease_holder!=self.dispatcher_name, Queue.lease_expiry<datetime.datetime.now())
+				)).limit(limit).all()
+		
+		if status == 'READY':
+			# No point fetching more items than could possibly be dispatched
+			return self.fetch_ready_items(db, min(len(self.renderer_servers), limit))
+		
+		return db.query(Queue).filter(Queue.status==status).filter(self.claimable()) \
+			.order_by(desc(Queue.priority), Queue.date).limit(limit).all()
+	
+	def fetch_ready_items(self, db, limit):
+		"""
+		Fetch READY items ordered by highest priority first, then by fair share
+		between users, then oldest first. A user's share is the number of their
+		items already RENDERING plus the number of their items ahead in this
+		list, so that one user's backlog cannot block everyone else's work.
+		"""
+		if limit < 1:
+			return []
+		
+		rendering = dict(
+			db.query(Queue.user_id, func.count(Queue.id)) \
+				.filter(Queue.status=='RENDERING').group_by(Queue.user_id).all()
+		)
+		ready_users = db.query(Queue.user_id).filter(Queue.status=='READY').filter(self.claimable()).distinct().all()
+		
+		candidates = []
+		for (user_id,) in ready_users:
+			user_items = db.query(Queue).filter(Queue.status=='READY').filter(self.claimable()).filter(Queue.user_id==user_id) \
+				.order_by(desc(Queue.priority), Queue.date).limit(limit).all()
+			for share, qi in enumerate(user_items, rendering.get(user_id, 0)):
+				candidates.append( ((-qi.priority, share, qi.date), qi) )
+		
+		candidates.sort(key=lambda c: c[0])
+		return [c[1] for c in candidates[:limit]]
 	
 	# Warning: do not call server.wait() in any of these handlers!
 	# The Dispatcher should be mostly stateless such that if it is stopped and
 	# restarted (or if there is more than one Dispatcher running on the network),
-	# everything picks up where it left off.
+	# everything picks up where it left off. Each handler is only called for
+	# items whose lease this Dispatcher holds.
 	
 	def handler_NULL(self, qi):
 		"""NULL action, do nothing with this item"""
 		self.dbo('Nothing to do for %s' % qi)
 	
+	def handler_DISTRIBUTING(self, qi):
+		"""DISTRIBUTING action:
+		The Dispatcher which was distributing this item has let its lease
+		expire, so it has probably gone away. Change status back to PENDING
+		to distribute the item again.
+		"""
+		self.log('Distribution of %s was abandoned, starting again' % qi)
+		qi.status = 'PENDING'
+		qi.status_data = ''
+	
 	def handler_PENDING(self, qi):
 		"""PENDING action:
 		Change status to DISTRIBUTING and copy the scene to NetworkStorage
 		"""
 		self.dbo('PENDING handler for %s' % qi)
+		if self.distribute_pool.free_slots() <= len(self._pending_jobs):
+			# Leave the item PENDING until the distribution backlog clears
+			self.dbo('Distribution queue full, deferring %s' % qi)
+			return
+		
+		cfg = LuxFireConfig.Instance()
+		size = dir_size( os.path.join(cfg.LocalStorage(), qi.path) )
+		
 		qi.status = 'DISTRIBUTING'
 		dd = DispatcherDistributor(debug=self.debug)
 		dd.qi_id = qi.id
-		self._distributor_threads.append(dd)
-		dd.start()
+		self._pending_jobs.append( (self.distribute_pool, dd.run, (), size) )
 	
 	def handler_READY(self, qi):
 		"""READY action:
-		Find an available rendering server and start the rendering process;
-		change status to RENDERING.
+		Find available rendering servers and start the rendering process;
+		change status to RENDERING. If split_renderers is configured, items
+		with a large haltspp are split across several idle servers, each one
+		rendering a share of the haltspp into its own partial film.
 		
 		If there are no available servers, we can safely do nothing here, and
 		wait for the next DispatcherTimer kick.
 		"""
-		for renderer_server_name, (RC, proxy) in self.renderer_servers.items():
-			if RC.getAttribute('renderer', 'name') == 0:
-				# This server is idle! Bag it!
-				del self.renderer_servers[renderer_server_name]
-				
-				scene_path = '%s'%qi.path
-				scene_name = '%s'%qi.status_data
-				
-				qi.status = 'RENDERING'
-				qi.status_data = renderer_server_name
-				
-				# Set up the rendering in another thread, lets get these records
-				# processed ASAP!
-				rst = threading.Thread(
-					target=self.start_server,
-					args=(RC, renderer_server_name, proxy, scene_path, scene_name, qi.haltspp, qi)
-				)
-				self._render_start_threads.append(rst)
-				rst.start()
-				
-				break
+		wanted = min( self.split_count(qi), self.render_start_pool.free_slots() - len(self._pending_jobs) )
+		if wanted < 1:
+			self.dbo('Render start queue full, deferring %s' % qi)
+			return
+		
+		# These servers are idle! Bag them!
+		idle_renderers = self.idle_renderers()
+		idle_servers = idle_renderers[:wanted]
+		del idle_renderers[:wanted]
+		
+		if len(idle_servers) == 0:
+			return
+		
+		scene_path = '%s'%qi.path
+		scene_name = '%s'%qi.status_data
+		
+		parts = len(idle_servers)
+		haltspp = qi.haltspp
+		if parts > 1:
+			haltspp = int(math.ceil(qi.haltspp / float(parts)))
+		
+		qi.status = 'RENDERING'
+		qi.status_data = ','.join([STARTING + renderer_server_name for renderer_server_name, RC, proxy in idle_servers])
+		
+		for part, (renderer_server_name, RC, proxy) in enumerate(idle_servers):	#@UnusedVariable
+			film_name = None
+			if parts > 1:
+				film_name = film_part_name(scene_name, part)
+			
+			# Set up the rendering in the render_start_pool, lets get these
+			# records processed ASAP!
+			self._pending_jobs.append( (
+				self.render_start_pool,
+				self.start_server,
+				(renderer_server_name, proxy, scene_path, scene_name, haltspp, qi.id, film_name),
+				0
+			) )
+	
+	def idle_renderers(self):
+		"""
+		The idle Renderer.Servers which have not been given an item in this
+		pass. Their status is asked for on the first call of a pass only;
+		busy and unreachable servers are dropped from renderer_servers, and
+		the servers are dropped from it as they are found idle, so that no
+		other handler uses them. handler_READY() takes the servers it gives
+		an item out of the returned list.
+		"""
+		if self._idle_renderers is not None:
+			return self._idle_renderers
+		
+		self._idle_renderers = []
+		for renderer_server_name, (RC, proxy) in list(self.renderer_servers.items()):
+			if renderer_server_name in self.unconfirmed_renderers:
+				continue
+			del self.renderer_servers[renderer_server_name]
+			try:
+				idle = RC.get_status_snapshot()['idle']
+			except Pyro.errors.PyroError as err:
+				self.log('Cannot get status of %s: %s' % (renderer_server_name, err))
+				RendererRegistry.Instance().discard(renderer_server_name)
+				continue
+			if idle:
+				self._idle_renderers.append( (renderer_server_name, RC, proxy) )
+		return self._idle_renderers
+	
+	def split_count(self, qi):
+		"""
+		Number of servers to render a READY item on. Enough servers are left
+		over for the other READY items in this pass.
+		"""
+		cfg = LuxFireConfig.Instance()
+		split_renderers = cfg.getint('Dispatcher', 'split_renderers')
+		if split_renderers < 2 or qi.haltspp < cfg.getint('Dispatcher', 'split_min_haltspp'):
+			return 1
+		
+		spare = len(self.idle_renderers()) // (self.items_remaining + 1)
+		return max(1, min(split_renderers, spare))
 	
 	def handler_RENDERING(self, qi):
 		"""RENDERING action:
-		Check up on the server which is rendering this scene and see if it
-		has finished or not. If it has finished, remove the scene data from
-		LocalStorage and NetworkStorage, and move the job to the Results table.
+		Check up on the servers which are rendering this scene and see if they
+		have finished or not. If they have all finished, remove the scene data
+		from LocalStorage and NetworkStorage, and move the job to the Results
+		table. If the item was split, its partial films are merged first, see
+		merge_films().
 		"""
 		self.dbo('RENDERING handler: %s' % qi)
-		renderer_server_name = qi.status_data
-		if renderer_server_name in self.renderer_servers.keys():
-			RC, proxy = self.renderer_servers[renderer_server_name]	#@UnusedVariable
-			if RC.getAttribute('renderer', 'name') == 0:
-				# Rendering must have finished!
-				with DatabaseSession() as db:
-					ri = Result()
-					ri.date = datetime.datetime.now()
-					ri.jobname = qi.jobname
-					ri.path = qi.path
-					ri.status = 'RENDER_COMPLETE'
-					ri.user_id = qi.user_id
-					db.add(ri)
-					db.delete(qi)
+		if qi.status_data == MERGING:
+			with self.merging_lock:
+				pending = qi.id in self.merging
+			if not pending:
+				# The merge was lost, e.g. this Dispatcher was restarted
+				qi.status = 'ERROR'
+				qi.status_data = 'Film merge was interrupted'
+				self.dbo('Rendering error: %s' % qi)
+			return
+		
+		for renderer_server_name in qi.status_data.split(','):
+			if renderer_server_name.startswith(STARTING):
+				# An idle server has not finished, it may not have started
+				# yet; it is busy until its start_server() job is done
+				renderer_server_name = renderer_server_name[len(STARTING):]
+				self.renderer_servers.pop(renderer_server_name, None)
+				with self.starting_lock:
+					pending = (qi.id, renderer_server_name) in self.starting
+				if not pending:
+					# The job was lost, e.g. this Dispatcher was restarted
+					qi.status = 'ERROR'
+					qi.status_data = 'Render start on %s was interrupted' % renderer_server_name
+					self.dbo('Rendering error: %s' % qi)
+					break
+				continue
+			if renderer_server_name in self.renderer_servers.keys():
+				RC, proxy = self.renderer_servers[renderer_server_name]	#@UnusedVariable
+				try:
+					status = RC.get_status_snapshot()
+				except Pyro.errors.PyroError as err:
+					# Leave the item RENDERING, the server is checked again
+					# on the next pass
+					self.log('Cannot get status of %s: %s' % (renderer_server_name, err))
+					del self.renderer_servers[renderer_server_name]
+					RendererRegistry.Instance().discard(renderer_server_name)
+					continue
+				if status['idle']:
+					# Rendering must have finished, but the Renderer.Server's
+					# render_finished() notification was missed
+					if renderer_finished(qi, renderer_server_name):
+						break
+				else:
+					# Renderer.Server is busy, print out what it's doing
+					self.dbo('%s: %s' % (renderer_server_name, status['stats']))
+					# Make server unavailable for further actions
+					del self.renderer_servers[renderer_server_name]
 			else:
-				# Renderer.Server is busy, print out what it's doing
-				self.dbo('%s: %s' % (renderer_server_name, RC.printableStatistics(True)))
-				# Make server unavailable for further actions
-				del self.renderer_servers[renderer_server_name]
-		else:
-			qi.status = 'ERROR'
-			qi.status_data = 'Renderer.Server disappeared?'
-			self.dbo('Rendering error: %s' % qi)
+				qi.status = 'ERROR'
+				qi.status_data = 'Renderer.Server disappeared?'
+				self.dbo('Rendering error: %s' % qi)
+				break
+		
+		if qi.status == 'RENDERING' and qi.status_data == MERGING:
+			self._pending_jobs.append( (self.distribute_pool, self.merge_films, (qi,), 0) )
+	
+	@classmethod
+	def merge_films(cls, qi):
+		"""
+		Merge the partial films of a split item, once MERGING has been stored
+		for it, and store its outcome. This runs outside of any transaction,
+		in the distribute_pool or the thread of a render_finished() call.
+		The item's id must have been added to merging.
+		"""
+		try:
+			merge_film_parts(qi)
+			status, status_data = 'RENDER_COMPLETE', ''
+		except Exception as err:
+			DispatcherLog('Film merge of %s failed: %s' % (qi, err))
+			status, status_data = 'ERROR', 'Film merge failed: %s' % err
+		
+		try:
+			DatabaseTransaction(store_item, qi.id, 'RENDERING', MERGING, status, status_data)
+		finally:
+			with cls.merging_lock:
+				cls.merging.discard(qi.id)
+		DispatcherTimer.wake()
 	
-	def start_server(self, server, server_name, proxy, net_path, scene_file, haltspp, qi):
+	def start_server(self, server_name, proxy, net_path, scene_file, haltspp, qi_id, film_name=None):
 		"""
-		This method runs as a thread because of the while..sleep loop
+		This method runs in the render_start_pool because of the while..sleep
+		loop.
+		If film_name is given, the server will use it for its outputs, and
+		save its film to film_name.flm when the rendering finishes.
+		
+		Once the rendering has started, the start is confirmed in the item's
+		status_data, so that the server is no longer taken to be idle because
+		it has not started yet. If the start fails, the item is set to ERROR.
+		"""
+		try:
+			self.start_rendering(proxy, net_path, scene_file, haltspp, qi_id, film_name)
+			DatabaseTransaction(confirm_start, qi_id, server_name)
+			self.log('Started %s/%s on render server %s' % (net_path, scene_file, server_name))
+		except Exception as err:
+			self.log('Cannot start %s/%s on render server %s: %s' % (net_path, scene_file, server_name, err))
+			DatabaseTransaction(fail_item, qi_id, 'RENDERING', 'Render start on %s failed: %s' % (server_name, err))
+		finally:
+			with self.starting_lock:
+				self.starting.discard( (qi_id, server_name) )
+		DispatcherTimer.wake()
+	
+	def start_rendering(self, proxy, net_path, scene_file, haltspp, qi_id, film_name):
 		"""
-		proxy.SetNetworkWD(net_path)
-		server.parse(scene_file, True) # async parse
+		Make the remote calls which start the rendering on a server. They are
+		sent in batches, so that starting a server takes three round trips
+		plus one per poll of the parser, instead of one round trip per call.
+		"""
+		calls = Pyro.core.batch(proxy)
+		calls.SetNetworkWD(net_path)
+		calls.luxcall('parse', scene_file, True) # async parse
+		calls.GetThreadCount()
+		_, _, thread_count = calls()
 		
-		while server.statistics('sceneIsReady') != 1.0:
+		while True:
+			calls.luxcall('statistics', 'sceneIsReady')
+			calls.luxcall('parseSuccessful')
+			scene_ready, parse_ok = calls()
+			if scene_ready == 1.0:
+				break
 			time.sleep(0.3)
-			if not server.parseSuccessful():
-				qi.status = 'ERROR'
-				qi.status_data = 'Bad scene file (parse error)'
-				self.log('%s' % qi) # str(qi) contains the error message
-				return
+			if not parse_ok:
+				raise Exception('Bad scene file (parse error)')
 		
 		# Set termination criteria
-		server.setHaltSamplesPerPixel(haltspp, False, True)
+		calls.luxcall('setHaltSamplesPerPixel', haltspp, False, True)
+		
+		# Give the servers of a split item their own outputs, instead of all
+		# writing the scene's
+		flm_file = None
+		if film_name is not None:
+			calls.luxcall('setAttribute', 'film', 'filename', film_name)
+			flm_file = film_name + '.flm'
 		
 		# Get Server up to configured speed
-		# 1 is subtracted from GetThreadCouny because parse() already created
+		# 1 is subtracted from GetThreadCount because parse() already created
 		# a thread for us
-		for i in range(proxy.GetThreadCount()-1):	#@UnusedVariable
-			server.addThread()
+		for i in range(thread_count-1):	#@UnusedVariable
+			calls.luxcall('addThread')
 		
 		# StartMonitoringContext is essential so that the Renderer.Server can
-		# monitor and clean itself up when the rendering completes
-		proxy.StartMonitoringContext()
-		self.log('Started %s/%s on render server %s' % (net_path, scene_file, server_name))
+		# monitor and clean itself up when the rendering completes, it will
+		# then notify this Dispatcher by calling render_finished()
+		calls.StartMonitoringContext(self.dispatcher_name, flm_file, qi_id)
+		calls()
 
 class DispatcherTimer(TimerThread, ServerObject):
 	"""
-	This Timer will spawn worker threads at regular intervals
+	This Timer will spawn worker threads whenever it is woken up by a change
+	to the Queue. Worker threads are also spawned at regular intervals as a
+	safety net, in case a wake up was missed.
+	
+	If event_driven is disabled in the config, this Timer will only spawn
+	worker threads at regular intervals.
 	"""
 	
 	def __repr__(self):
 		return '<DispatcherTimer>'
 	
-	KICK_PERIOD = LuxFireConfig.Instance().getint('Dispatcher', 'process_interval')
+	EVENT_DRIVEN = LuxFireConfig.Instance().getboolean('Dispatcher', 'event_driven')
+	
+	if EVENT_DRIVEN:
+		KICK_PERIOD = LuxFireConfig.Instance().getint('Dispatcher', 'safety_interval')
+	else:
+		KICK_PERIOD = LuxFireConfig.Instance().getint('Dispatcher', 'process_interval')
 	
 	_worker_pool = []
 	
+	dispatcher_name = None
+	
+	distribute_pool = None
+	render_start_pool = None
+	archive_pool = None
+	
+	# time.time() when old Results should next be archived
+	next_archive = 0
+	
+	#@class var
+	wake_event = threading.Event()
+	
+	@classmethod
+	def wake(cls):
+		"""Ask for a DispatcherWorker pass as soon as possible"""
+		cls.wake_event.set()
+	
 	def _purge_threads(self, join=False):
 		for old_dwt in [t for t in self._worker_pool]: # copy the list or remove() might not work
 			if join: old_dwt.join()
 			if not old_dwt.is_alive():
 				self._worker_pool.remove(old_dwt)
 	
+	def start_pools(self):
+		cfg = LuxFireConfig.Instance()
+		max_queued = cfg.getint('Dispatcher', 'max_queued_jobs')
+		self.distribute_pool = WorkerPool(
+			cfg.getint('Dispatcher', 'distribute_workers'), max_queued,
+			debug=self.debug, name='LuxFire.DispatcherDistributorPool'
+		)
+		self.render_start_pool = WorkerPool(
+			cfg.getint('Dispatcher', 'render_start_workers'), max_queued,
+			debug=self.debug, name='LuxFire.DispatcherRenderStartPool'
+		)
+		# Archiving can take a while, it has a worker of its own so that it
+		# doesn't hold up the distribution of new work
+		self.archive_pool = WorkerPool(
+			1, 1,
+			debug=self.debug, name='LuxFire.DispatcherArchivePool'
+		)
+	
+	def stop_pools(self):
+		for pool in (self.distribute_pool, self.render_start_pool, self.archive_pool):
+			if pool is not None: pool.stop()
+	
+	def run(self):
+		self.start_pools()
+		
+		if not self.EVENT_DRIVEN:
+			TimerThread.run(self)
+			return
+		
+		# Process the Queue once at start up, to pick up where we left off
+		self.wake()
+		while self.active:
+			self.wake_event.wait(self.KICK_PERIOD)
+			self.wake_event.clear()
+			if not self.active: break
+			
+			self.kick()
+			# Only one DispatcherWorker runs at a time; any wake() calls made
+			# whilst it is running will cause another pass straight after
+			self._purge_threads(join=True)
+	
 	def kick(self):
 		self.dbo('Kick!')
 		self._purge_threads()
+		self.archive_results()
+		
+		# Passes never overlap. When polling, a pass that is still running
+		# when the next one is due covers for it, the next one is skipped
+		if len(self._worker_pool) > 0:
+			self.dbo('DispatcherWorker still running, skipping this pass')
+			return
 		
 		dwt = DispatcherWorker(debug=self.debug)
+		dwt.dispatcher_name = self.dispatcher_name
+		dwt.distribute_pool = self.distribute_pool
+		dwt.render_start_pool = self.render_start_pool
 		self._worker_pool.append(dwt)
 		dwt.start()
 		self.dbo('Have %i DispatcherWorkers' % len(self._worker_pool))
 	
+	def archive_results(self):
+		"""
+		Every archive_interval, submit a job to archive the Results older
+		than archive_after_days
+		"""
+		cfg = LuxFireConfig.Instance()
+		days = cfg.getint('Dispatcher', 'archive_after_days')
+		if days < 1 or time.time() < self.next_archive:
+			return
+		
+		self.next_archive = time.time() + cfg.getint('Dispatcher', 'archive_interval')
+		before = datetime.datetime.now() - datetime.timedelta(days=days)
+		self.archive_pool.submit(self._archive, (ResultArchive(cfg.get('Dispatcher', 'archive_path')), before))
+	
+	def _archive(self, archive, before):
+		archived = archive.archive(before)
+		if archived > 0:
+			self.log('Archived %i Results from before %s' % (archived, before))
+	
 	def stop(self):
 		TimerThread.stop(self)
+		self.wake_event.set()
 		self._purge_threads(join=True)
+		self.stop_pools()
 
 class Dispatcher(ServerObject):
 	"""
 	When running in Server mode, the Dispatcher will start a timer to spawn
-	worker threads which will process the Queue.
+	worker threads which will process the Queue. Methods which change the
+	Queue wake the timer up so that the change is processed right away.
 	"""
 	
 	_Service_Type = 'Dispatcher'
 	
+	# Most rows list_queue() and list_results() return in one call
+	MAX_LIST_ROWS = 500
+	
 	timer = DispatcherTimer()
 	
-	def _verify_user_key(self, user_id, d_key):
+	def _verify_user_key(self, user_id, d_key, scope=''):
 		"""
 		Verify that a user request contains the correct
 		key for authentication. Raises ClientException
 		on failure.
 		"""
-		verified = False
-		with DatabaseSession() as db:
-			us = db.query(UserSession).filter(UserSession.user_id==user_id).all()
-			for user_session in us:
-				if 'dispatcher_key' in user_session.session_data.keys() and user_session.session_data['dispatcher_key']==d_key:
-					verified = True
-					
-					# Remove the key from the session once found
-					del user_session.session_data['dispatcher_key']
-					db.add(user_session)
-					break
-		if not verified:
+		if not DispatcherToken.Instance().verify(user_id, d_key, scope):
 			raise ClientException('Dispatcher session authentication failure')
 	
 	# All dispatcher methods need to RETURN values, and not use *Log or print
 	# so the the methods are servable over the network
 	
-	def add_queue(self, user_id, d_key, jobname, haltspp=-1, halttime=-1):
+	def add_queue(self, user_id, d_key, jobname, haltspp=-1, halttime=-1, priority=0):
 		self._verify_user_key(user_id, d_key)
 		
 		with DatabaseSession() as db:
@@ -391,10 +1042,12 @@ class Dispatcher(ServerObject):
 		q.jobname = jobname
 		q.haltspp = haltspp
 		q.halttime = halttime
+		q.priority = priority
 		q.date = datetime.datetime.now()
 		q.status = 'NEW'
 		with DatabaseSession() as db:
 			db.add(q)
+		self.timer.wake()
 		return True
 	
 	def finalise_queue(self, user_id, d_key, jobname):
@@ -406,6 +1059,7 @@ class Dispatcher(ServerObject):
 			# If not exactly one q found, exception will be passed back to user
 			q.status = 'PENDING'
 			q.status_data = ''
+		self.timer.wake()
 		return True
 	
 	def abort_queue(self, user_id, d_key, jobname):
@@ -431,35 +1085,204 @@ class Dispatcher(ServerObject):
 			if q.status == 'ERROR':
 				q.status = 'NEW'
 				q.status_data = ''
+		self.timer.wake()
 		return True
 	
-	def add_file(self, user_id, d_key, jobname, filename, filedata):
-		"""Receive file data for the Queue item"""
-		self._verify_user_key(user_id, d_key)
-		
+	def _upload_path(self, user_id, jobname, filename):
+		"""Path in LocalStorage of a file being uploaded for a NEW Queue item"""
 		with DatabaseSession() as db:
 			q = db.query(Queue).filter(Queue.user_id==user_id).filter(Queue.jobname==jobname).one()
 			if q.status != 'NEW':
 				raise Exception('Wrong queue status for file upload!')
 			
 			job_path = os.path.join( LuxFireConfig.Instance().LocalStorage(), q.path )
-			if not os.path.exists(job_path):
-				os.makedirs(job_path)
-			file_path = os.path.join(job_path, filename)
-			with open(file_path, 'wb') as file:
-				file.write(filedata)
+			with DispatcherDistributor.path_create_lock:
+				if not os.path.exists(job_path):
+					os.makedirs(job_path)
+			return os.path.join(job_path, os.path.basename(filename))
+	
+	def add_file(self, user_id, d_key, jobname, filename, filedata):
+		"""Receive file data for the Queue item"""
+		self._verify_user_key(user_id, d_key)
+		
+		file_path = self._upload_path(user_id, jobname, filename)
+		with open(file_path, 'wb') as file:
+			file.write(filedata)
 		
 		return True
 	
-	def list_queue(self):
-		return Database.Session().query(Queue).options(eagerload('user')).order_by(desc(Queue.id)).all()
+	def get_file_offset(self, user_id, d_key, jobname, filename, size, first_checksum):
+		"""
+		Return the number of bytes of a chunked upload received so far, so
+		that an interrupted upload can be resumed from there. size is the
+		total size of the file and first_checksum the SHA1 hex digest of its
+		first chunk. They are kept with the received data, and if they don't
+		match those of the upload which left it, the data is discarded and
+		the upload starts again from 0.
+		"""
+		self._verify_user_key(user_id, d_key, DispatcherToken.upload_scope(jobname, filename))
+		
+		part_path = self._upload_path(user_id, jobname, filename) + '.part'
+		info = '%i %s' % (size, first_checksum)
+		if os.path.exists(part_path):
+			try:
+				with open(part_path + '.info') as file:
+					if file.read() == info:
+						return os.path.getsize(part_path)
+			except IOError:
+				pass
+			os.remove(part_path)
+		
+		with open(part_path + '.info', 'w') as file:
+			file.write(info)
+		return 0
 	
-	def list_results(self):
-		return Database.Session().query(Result).options(eagerload('user')).order_by(desc(Result.id)).all()
+	def add_file_chunk(self, user_id, d_key, jobname, filename, offset, chunk, checksum):
+		"""
+		Receive one chunk of file data for the Queue item, to be written at
+		offset. checksum is the SHA1 hex digest of chunk. Any data already
+		received beyond offset is discarded. Returns the new file offset.
+		"""
+		self._verify_user_key(user_id, d_key, DispatcherToken.upload_scope(jobname, filename))
+		
+		if hashlib.sha1(chunk).hexdigest() != checksum:
+			raise ClientException('Chunk checksum mismatch')
+		
+		part_path = self._upload_path(user_id, jobname, filename) + '.part'
+		size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+		if offset > size:
+			raise ClientException('Chunk offset %i is beyond received data (%i bytes)' % (offset, size))
+		
+		with open(part_path, 'r+b' if size > 0 else 'wb') as file:
+			file.seek(offset)
+			file.write(chunk)
+			file.truncate()
+		
+		return offset + len(chunk)
+	
+	def commit_file(self, user_id, d_key, jobname, filename, size, checksum):
+		"""
+		Finish a chunked upload. The assembled file must have the given size
+		and SHA1 hex digest, otherwise it is discarded and the upload has to
+		be started again.
+		"""
+		self._verify_user_key(user_id, d_key, DispatcherToken.upload_scope(jobname, filename))
+		
+		file_path = self._upload_path(user_id, jobname, filename)
+		part_path = file_path + '.part'
+		if not os.path.exists(part_path):
+			raise ClientException('No upload in progress for %s' % filename)
+		
+		if os.path.exists(part_path + '.info'):
+			os.remove(part_path + '.info')
+		
+		h = hashlib.sha1()
+		with open(part_path, 'rb') as file:
+			for block in iter(lambda: file.read(1024*1024), b''):
+				h.update(block)
+		
+		if os.path.getsize(part_path) != size or h.hexdigest() != checksum:
+			os.remove(part_path)
+			raise ClientException('Uploaded file %s failed verification' % filename)
+		
+		if os.path.exists(file_path):
+			os.remove(file_path)
+		os.rename(part_path, file_path)
+		
+		return True
+	
+	def render_finished(self, qi_id, renderer_name, result, message=''):
+		"""
+		Called by a Renderer.Server (oneway) when its rendering of Queue item
+		qi_id has finished or failed, so that the item can be dealt with and
+		the next item dispatched without waiting for the next DispatcherWorker
+		pass. result is one of the ResultStatuses.
+		
+		If another Renderer.Server of the item finished meanwhile, the item is
+		read again and this is tried again. If this was the last server of a
+		split item, its films are merged here once MERGING is stored.
+		"""
+		while True:
+			qi = DatabaseTransaction(fetch_item, qi_id, 'RENDERING')
+			if qi is None or not set([renderer_name, STARTING + renderer_name]) & set(qi.status_data.split(',')):
+				break
+			handled_with = qi.status_data
+			if result == 'RENDER_COMPLETE':
+				renderer_finished(qi, renderer_name)
+			else:
+				qi.status = 'ERROR'
+				qi.status_data = message or result
+			merge = qi.status == 'RENDERING' and qi.status_data == MERGING
+			if merge:
+				with DispatcherWorker.merging_lock:
+					DispatcherWorker.merging.add(qi_id)
+			if DatabaseTransaction(store_item, qi_id, 'RENDERING', handled_with, qi.status, qi.status_data):
+				if merge:
+					DispatcherWorker.merge_films(qi)
+				break
+			if merge:
+				with DispatcherWorker.merging_lock:
+					DispatcherWorker.merging.discard(qi_id)
+		self.timer.wake()
+	
+	def _list_rows(self, model, columns, user_id, status, date_from, date_to, before_id, limit):
+		"""
+		Page of rows of the given columns of model, newest first. Paging is
+		by id rather than by offset, so that a page costs the same however
+		far back it is.
+		"""
+		with DatabaseSession() as db:
+			q = db.query(*[
+				User.email if column == 'email' else getattr(model, column)
+				for column in columns
+			]).outerjoin(model.user)
+			if user_id is not None:
+				q = q.filter(model.user_id==user_id)
+			if status is not None:
+				q = q.filter(model.status==status)
+			if date_from is not None:
+				q = q.filter(model.date>=date_from)
+			if date_to is not None:
+				q = q.filter(model.date<date_to)
+			if before_id is not None:
+				q = q.filter(model.id<before_id)
+			
+			limit = max(1, min(limit, self.MAX_LIST_ROWS))
+			return [tuple(row) for row in q.order_by(desc(model.id)).limit(limit).all()]
+	
+	def list_queue(self, user_id=None, status=None, date_from=None, date_to=None, before_id=None, limit=50):
+		"""
+		List Queue items as tuples of Dispatcher.Client.QueueListColumns,
+		newest first. The items can be filtered by user, status and date.
+		To get the next page, pass the id of the last item as before_id.
+		"""
+		return self._list_rows(Queue, QueueListColumns, user_id, status, date_from, date_to, before_id, limit)
+	
+	def list_results(self, user_id=None, status=None, date_from=None, date_to=None, before_id=None, limit=50):
+		"""
+		List Results as tuples of Dispatcher.Client.ResultListColumns, in the
+		same way as list_queue()
+		"""
+		return self._list_rows(Result, ResultListColumns, user_id, status, date_from, date_to, before_id, limit)
+	
+	def count_results(self, user_id):
+		"""
+		Number of Results of a user per status, including those which have
+		been archived
+		"""
+		with DatabaseSession() as db:
+			counts = dict(
+				db.query(Result.status, func.count(Result.id)) \
+					.filter(Result.user_id==user_id).group_by(Result.status).all()
+			)
+			for rc in db.query(ResultCount).filter(ResultCount.user_id==user_id):
+				counts[rc.status] = counts.get(rc.status, 0) + rc.count
+			return counts
 	
 	def _start(self):
 		"""Start up the server loop thread"""
 		self.timer.SetDebug(self.debug)
+		self.timer.dispatcher_name = self.name
 		self.timer.start()
 	
 	def _stop(self):
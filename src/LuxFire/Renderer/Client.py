@@ -31,9 +31,11 @@ the LuxRender Context which is being served.
 """
 
 # Pyro Imports
+import threading
+
 import Pyro
 
-from ..Client import ListLuxFireGroup, ServerLocator, ClientException
+from ..Client import ListLuxFireGroup, ClientException
 
 class RemoteCallable(object):
 	'''
@@ -100,22 +102,93 @@ class RendererClient(object):
 		else:
 			raise AttributeError('Cannot access remote private members')
 
-def RendererGroup():
-	LuxSlavesNames = ListLuxFireGroup('Renderer')
+class RendererRegistry(object):
+	'''
+	Long-lived registry of remote Renderer.Servers. The proxies and the remote
+	Context method lists are kept between calls, and the membership is kept up
+	to date by comparing the nameserver listing with the known Renderers, so
+	that only new or changed Renderers need to be connected to.
 	
-	if len(LuxSlavesNames) > 0:
-		slaves = {}
-		for LN in LuxSlavesNames:
-			try:
-				RS = ServerLocator.Instance().get_by_name(LN)
-				LS = RendererClient(RS)
-				slaves[LN] = (LS, RS)
-			except Exception as err:
-				raise ClientException('Error with remote renderer %s: %s' % (LN, err))
+	A Renderer that cannot be connected to is left out until a later refresh,
+	instead of failing the whole group.
+	'''
+	
+	_instance = None
+	
+	@classmethod
+	def Instance(cls):
+		if cls._instance == None:
+			cls._instance = cls()
+		return cls._instance
+	
+	def __init__(self):
+		self.lock = threading.Lock()
+		
+		# Dict of name: (uri, RendererClient, Proxy)
+		self.renderers = {}
+		
+		# Connection errors of the last refresh
+		self.errors = []
+	
+	def refresh(self):
+		'''
+		Bring the registry up to date with the nameserver. Renderers which
+		cannot be connected to are skipped, and their errors kept in
+		self.errors
+		'''
 		
-		return slaves
-	else:
-		raise ClientException('No Renderers found')
+		listed = dict(ListLuxFireGroup('Renderer'))
+		errors = []
+		
+		with self.lock:
+			for LN in list(self.renderers.keys()):
+				if LN not in listed:
+					del self.renderers[LN]
+			
+			for LN, uri in listed.items():
+				if LN in self.renderers and self.renderers[LN][0] == uri:
+					continue
+				try:
+					RS = Pyro.core.PooledProxy(uri)
+					LS = RendererClient(RS)
+					self.renderers[LN] = (uri, LS, RS)
+				except Exception as err:
+					if LN in self.renderers:
+						del self.renderers[LN]
+					errors.append('Error with remote renderer %s: %s' % (LN, err))
+			
+			self.errors = errors
+	
+	def discard(self, name):
+		'''
+		Forget about a Renderer whose calls are failing, it will be
+		reconnected on the next refresh() if it is still registered in the
+		nameserver
+		'''
+		
+		with self.lock:
+			if name in self.renderers:
+				del self.renderers[name]
+	
+	def group(self):
+		'''
+		Refresh the registry and return a dict of name: (RendererClient, Proxy)
+		'''
+		
+		self.refresh()
+		with self.lock:
+			if len(self.renderers) == 0:
+				if len(self.errors) > 0:
+					raise ClientException('\n'.join(self.errors))
+				raise ClientException('No Renderers found')
+			
+			slaves = {}
+			for LN, (uri, LS, RS) in self.renderers.items():	#@UnusedVariable
+				slaves[LN] = (LS, RS)
+			return slaves
+
+def RendererGroup():
+	return RendererRegistry.Instance().group()
 
 if __name__ == '__main__':
 	try:
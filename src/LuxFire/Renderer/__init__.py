@@ -33,6 +33,7 @@ import os, sys, threading
 from LuxRender import LuxLog
 
 # LuxFire imports 
+from ..Client import ServerLocator
 from ..Server import ServerObject
 from .. import LuxFireConfig
 
@@ -92,22 +93,71 @@ class Renderer(ServerObject):
 	def GetThreadCount(self):
 		return LuxFireConfig.Instance().getint('Renderer', 'threads_per_server')
 	
-	def StartMonitoringContext(self):
-		threading.Thread(target=self._context_monitor).start()
+	def StartMonitoringContext(self, dispatcher_name=None, flm_file=None, qi_id=None):
+		'''
+		Monitor the Context until the rendering finishes. If dispatcher_name
+		is given, that Dispatcher will be notified when it does, about the
+		Queue item qi_id. If flm_file is given, the film will be saved to that
+		file first.
+		'''
+		threading.Thread(target=self._context_monitor, args=(dispatcher_name, flm_file, qi_id)).start()
 	
-	def _context_monitor(self):
+	def _context_monitor(self, dispatcher_name=None, flm_file=None, qi_id=None):
 		rendering = threading.Event()
+		result = 'RENDER_COMPLETE'
+		message = ''
 		while not rendering.is_set():
-			if self._lux_context.statistics('filmIsReady') == 1.0 or \
-			   self._lux_context.statistics('terminated') == 1.0 or \
-			   self._lux_context.statistics('enoughSamples') == 1.0:
-				self._lux_context.exit()
-				self._lux_context.wait()
-				self._lux_context.cleanup()
+			try:
+				status = self.get_status_snapshot()
+				if status['filmIsReady'] == 1.0 or \
+				   status['terminated'] == 1.0 or \
+				   status['enoughSamples'] == 1.0:
+					if flm_file is not None:
+						self._lux_context.saveFLM(flm_file)
+					self._lux_context.exit()
+					self._lux_context.wait()
+					self._lux_context.cleanup()
+					rendering.set()
+					self.log('Rendering finished!')
+				else:
+					rendering.wait(5)
+			except Exception as err:
+				result = 'SLAVE_FAILURE'
+				message = 'Rendering failed: %s' % err
 				rendering.set()
-				self.log('Rendering finished!')
-			else:
-				rendering.wait(5)
+				self.log(message)
+		
+		if dispatcher_name is not None:
+			self._notify_dispatcher(dispatcher_name, qi_id, result, message)
+	
+	def _notify_dispatcher(self, dispatcher_name, qi_id, result, message):
+		'''
+		Tell the Dispatcher that the rendering has finished, using a oneway
+		call so that we don't wait for it to process the result
+		'''
+		try:
+			dispatcher = ServerLocator.Instance().get_by_name(dispatcher_name)
+			dispatcher._pyroOneway.add('render_finished')
+			dispatcher.render_finished(qi_id, self.name, result, message)
+		except Exception as err:
+			ServerLocator.Instance().forget(dispatcher_name)
+			self.log('Cannot notify %s: %s' % (dispatcher_name, err))
+	
+	def get_status_snapshot(self):
+		'''
+		Return the state of the Context in a single call, as a dict containing
+		idle, sceneIsReady, filmIsReady, terminated, enoughSamples, samplesSec
+		and the printable statistics string (stats)
+		'''
+		status = {
+			'name': self.name,
+			'idle': self.luxcall('getAttribute', 'renderer', 'name') == 0,
+		}
+		for stat in ('sceneIsReady', 'filmIsReady', 'terminated', 'enoughSamples', 'samplesSec'):
+			status[stat] = self.luxcall('statistics', stat)
+		status['stats'] = self.luxcall('printableStatistics', True)
+		
+		return status
 	
 	def get_context_methods(self):
 		'''
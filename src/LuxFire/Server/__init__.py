@@ -30,7 +30,11 @@ objects across the network.
 """
 
 # System imports
-import signal, threading, time
+import itertools, signal, sys, threading, time
+if sys.version >= '3.0':
+	import queue
+else:
+	import Queue as queue	#@UnresolvedImport
 
 # Non-System imports
 import Pyro
@@ -131,6 +135,75 @@ class ServerObjectThread(threading.Thread, ServerObject):
 		threading.Thread.__init__(self)
 		ServerObject.__init__(self, debug)
 
+class WorkerPool(ServerObject):
+	"""
+	A fixed number of worker threads which run submitted jobs from a bounded
+	queue. Jobs with a smaller size are run first, jobs of equal size in the
+	order they were submitted. So that a large job cannot be held back for
+	ever by a stream of small ones, jobs are first ordered by the
+	age_interval seconds long period they were submitted in: jobs from an
+	earlier period are always run before those from a later one.
+	
+	When the queue is full, submit() refuses the job instead of blocking, so
+	that the caller can leave the work for later.
+	"""
+	
+	_Service_Type = 'WorkerPool'
+	
+	def __init__(self, workers, max_queued, debug=False, name=None, age_interval=60):
+		ServerObject.__init__(self, debug, name)
+		self.max_queued = max_queued
+		self.age_interval = age_interval
+		self._queue = queue.PriorityQueue(max_queued)
+		self._sequence = itertools.count()
+		self._accepting = True
+		self._active = True
+		self._threads = []
+		for i in range(workers):	#@UnusedVariable
+			t = threading.Thread(target=self._work)
+			t.daemon = True
+			self._threads.append(t)
+			t.start()
+	
+	def free_slots(self):
+		"""Number of jobs that can currently be submitted without refusal"""
+		return self.max_queued - self._queue.qsize()
+	
+	def submit(self, func, args=(), size=0):
+		"""
+		Queue func(*args) to be run by a worker. Returns False if the queue is
+		full or the pool has been stopped.
+		"""
+		if not self._accepting:
+			return False
+		try:
+			epoch = int(time.time() // self.age_interval)
+			self._queue.put_nowait( (epoch, size, next(self._sequence), func, args) )
+			return True
+		except queue.Full:
+			return False
+	
+	def _work(self):
+		while self._active:
+			try:
+				epoch, size, seq, func, args = self._queue.get(timeout=1)	#@UnusedVariable
+			except queue.Empty:
+				continue
+			try:
+				func(*args)
+			except Exception as err:
+				self.log('Job %s failed: %s' % (func, err))
+			finally:
+				self._queue.task_done()
+	
+	def stop(self):
+		"""Stop accepting jobs, wait for queued jobs to finish and join the workers"""
+		self._accepting = False
+		self._queue.join()
+		self._active = False
+		for t in self._threads:
+			t.join()
+
 class ServerThread(ServerObjectThread):
 	'''
 	Pyro service thread
@@ -155,6 +228,10 @@ class ServerThread(ServerObjectThread):
 		self.so = self.daemon.register(self.service)
 	
 	def run(self):
+		# The NS forgets the service unless its lease is renewed in time,
+		# so a service that dies without removing itself is evicted
+		lease_ttl = LuxFireConfig.Instance().getfloat('LuxFire', 'ns_lease_ttl')
+		
 		# Max attempts to register in NS
 		create_attempts = 10
 		try:
@@ -165,7 +242,7 @@ class ServerThread(ServerObjectThread):
 		
 		while create_attempts > 0:
 			try:
-				ns.register(self.name, self.so)
+				ns.register(self.name, self.so, lease_ttl)
 				create_attempts = -1
 			except Exception as err:
 				self.log(err)
@@ -179,9 +256,20 @@ class ServerThread(ServerObjectThread):
 		self.log('Started: Pyro URL: %s' % self.so)
 		self.log('Discoverable in Pyro nameserver: %s' % (create_attempts!=0))
 		
+		self.lease_stop = threading.Event()
+		renewer = None
+		if create_attempts != 0:
+			renewer = threading.Thread(target=self._renew_lease, args=(lease_ttl,))
+			renewer.daemon = True
+			renewer.start()
+		
 		# Blocks until stopped externally
 		self.daemon.requestLoop()
 		
+		# Don't let the renewer register the service again after removal
+		self.lease_stop.set()
+		if renewer is not None:
+			renewer.join()
 		try:
 			ns.remove(self.name)
 		except: pass
@@ -194,6 +282,29 @@ class ServerThread(ServerObjectThread):
 			if 'ns' in locals(): del ns
 		
 		self.log('Stopped')
+	
+	def _renew_lease(self, lease_ttl):
+		"""
+		Renew the NS lease of this service a few times per lease_ttl, and
+		register it again if the NS forgot about it (e.g. it was restarted).
+		Each renewal connects to the NS and disconnects again, so that no
+		connection is kept open to tie up a worker thread of the NS.
+		"""
+		ns_uri = None
+		uri = self.so
+		while not self.lease_stop.wait(lease_ttl / 3):
+			try:
+				if ns_uri is None:
+					located = Pyro.naming.locateNS()
+					ns_uri = located._pyroUri
+					located._pyroRelease()
+				with Pyro.core.Proxy(ns_uri) as ns:
+					if not ns.renew(self.name, lease_ttl):
+						self.log('Lease expired, registering again')
+						ns.register(self.name, uri, lease_ttl)
+			except Exception as err:
+				self.dbo('Lease renewal error: %s' % err)
+				ns_uri = None
 
 class Server(ServerObject):
 	'''
@@ -227,8 +338,9 @@ class Server(ServerObject):
 		st.start()
 	
 	def start(self, _so):
-		# First set up bind address
+		# First set up bind address and transport
 		Pyro.config.HOST = self.bind
+		Pyro.config.SERVERTYPE = LuxFireConfig.Instance().get('LuxFire', 'pyro_servertype')
 		
 		self.log('Server starting...')
 		
@@ -42,7 +42,7 @@ if __name__ == '__main__':
 			print('------------------------------------------------------------------')
 			for LN, i in LuxSlavesNames.items():
 				RemoteRenderer = RendererClient(ServerLocator.Instance().get_by_name(LN))
-				ss = RemoteRenderer.printableStatistics(True)
+				ss = RemoteRenderer.get_status_snapshot()['stats']
 				if ss == '':
 					ss = 'Idle'
 				print('%s : %s' % (LN, ss))
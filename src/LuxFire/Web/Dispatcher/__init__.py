@@ -28,23 +28,37 @@
 LuxFire.Dispatcher information views
 """
 
+import sys
+
 from ...Client import ClientException
-from ...Dispatcher.Client import DispatcherGroup
+from ...Dispatcher.Client import DispatcherGroup, ListRows, QueueListColumns
 
 from .. import LuxFireWeb
 from .. import User
+if sys.version >= '3.0':
+	from ..bottle.bottle3 import request	#@UnresolvedImport
+else:
+	from ..bottle.bottle2 import request	#@UnresolvedImport
+
+# Number of Queue items shown per page
+QUEUE_PAGE_SIZE = 100
 
 @LuxFireWeb.route('/dispatcher')
 @User.protected()
 def dispatcher_index():
 	out = LuxFireWeb._templater.get_template('dispatcher_index.html').render()
 	
+	before = request.GET.get('before')	#@UndefinedVariable
 	try:
 		for sn, dispatcher in DispatcherGroup().items():
-			queue = dispatcher.list_queue()
+			queue = ListRows(QueueListColumns, dispatcher.list_queue(
+				before_id=int(before) if before else None,
+				limit=QUEUE_PAGE_SIZE
+			))
 			out += LuxFireWeb._templater.get_template('dispatcher_queue.html').render(
 				dispatcher=sn,
-				queue=queue
+				queue=queue,
+				older=queue[-1]['id'] if len(queue) == QUEUE_PAGE_SIZE else None
 			)
 	except ClientException as err:
 		out += '<div style="clear:both;"><em>Error: %s</em></div>' % err
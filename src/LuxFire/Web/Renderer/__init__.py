@@ -28,8 +28,10 @@
 LuxFire.Renderer information views
 """
 
+import Pyro.errors
+
 from ...Client import ClientException
-from ...Renderer.Client import RendererGroup, RendererClient
+from ...Renderer.Client import RendererGroup, RendererRegistry
 
 from .. import LuxFireWeb
 from .. import User
@@ -41,10 +43,13 @@ def renderer_index():
 	
 	try:
 		renderers = []
-		for rn, (client, proxy) in RendererGroup().items():
-			renderers.append(
-				(rn, client, proxy)
-			)
+		for rn, (client, proxy) in RendererGroup().items():	#@UnusedVariable
+			try:
+				status = client.get_status_snapshot()
+			except Pyro.errors.PyroError as err:
+				status = {'stats': 'Error: %s' % err}
+				RendererRegistry.Instance().discard(rn)
+			renderers.append( (rn, status) )
 		out += LuxFireWeb._templater.get_template('renderer_stats.html').render(
 			renderers=renderers
 		)
@@ -31,6 +31,7 @@ Web.Server runs the http server to run the web interface to LuxFire
 def web_serve(parse_cli=False):
 	from .. import LuxFireConfig
 	from . import LuxFireWeb, WebLog
+	from .User import start_session_sweeper
 	import sys, os
 	if sys.version >= '3.0':
 		from .bottle.bottle3 import run
@@ -66,6 +67,7 @@ def web_serve(parse_cli=False):
 	sys.path.insert(0, os.path.join(LuxFireWeb._data_root, os.path.pardir))
 	
 	WebLog('Using static document root: %s' % LuxFireWeb._static_root)
+	start_session_sweeper()
 	run(**LuxFireWebRunArgs)
 
 if __name__ == '__main__':
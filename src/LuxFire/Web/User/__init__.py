@@ -27,19 +27,22 @@
 """
 Interface for user session login/logout management
 """
-import datetime, hashlib, random, sys, time
+import datetime, hashlib, os, random, sys, threading, time
 
 from sqlalchemy.orm import eagerload	#@UnresolvedImport
 
-from ...Client import ClientException
+from LuxRender import TimerThread
+
+from ... import LuxFireConfig
+from ...Client import ClientException, DispatcherToken
 from ...Database.Models.Queue import Queue
 from ...Database.Models.Role import Role
 from ...Database.Models.User import User, EncryptedPasswordString
 from ...Database.Models.UserSession import UserSession
 
-from ...Dispatcher.Client import DispatcherGroup
+from ...Dispatcher.Client import DispatcherGroup, ListRows, QueueListColumns, ResultListColumns
 
-from .. import LuxFireWeb
+from .. import LuxFireWeb, WebLog
 if sys.version >= '3.0':
 	from ..bottle.bottle3 import request, response, redirect	#@UnresolvedImport
 else:
@@ -65,23 +68,110 @@ def find_dispatcher():
 #------------------------------------------------------------------------------ 
 COOKIE_EXPIRE_DAYS = 7
 
+# Number of Queue items and Results shown per page
+JOBS_PAGE_SIZE = 50
+
 # SESSION UTILS
 
+class CachedUserSession(object):
+	"""
+	Read-only copy of a UserSession, with the e-mail of its User and the
+	names of the User's Roles
+	"""
+	def __init__(self, user_session):
+		self.sess_id = user_session.sess_id
+		self.user_id = user_session.user_id
+		self.email = user_session.user.email
+		self.roles = frozenset([role.name for role in user_session.user.roles])
+		self.logged_in = user_session.logged_in
+		self.expiry = user_session.expiry
+
+class UserSessionCache(object):
+	"""
+	In-process cache of CachedUserSessions by session id, so that most
+	requests don't need to query the database for the session, the User
+	and its Roles. Entries are kept for ttl seconds, and are replaced or
+	removed straight away when this process changes the session.
+	"""
+	def __init__(self, ttl):
+		self.ttl = ttl
+		self.sessions = {}
+		self.lock = threading.Lock()
+	
+	def get(self, sess_id):
+		now = time.time()
+		with self.lock:
+			entry = self.sessions.get(sess_id)
+		if entry is not None and entry[0] > now and entry[1].expiry > datetime.datetime.now():
+			return entry[1]
+		
+		user_session = LuxFireWeb._db.query(UserSession).options(eagerload('user')) \
+			.filter(UserSession.sess_id==sess_id) \
+			.filter(UserSession.expiry>=datetime.datetime.now()).one()
+		return self.put(user_session)
+	
+	def put(self, user_session):
+		cached = CachedUserSession(user_session)
+		with self.lock:
+			self.sessions[cached.sess_id] = (time.time() + self.ttl, cached)
+		return cached
+	
+	def invalidate(self, sess_id):
+		with self.lock:
+			self.sessions.pop(sess_id, None)
+	
+	def purge(self):
+		"""Remove the expired entries"""
+		now = time.time()
+		with self.lock:
+			for sess_id, (expiry, cached) in list(self.sessions.items()):	#@UnusedVariable
+				if expiry <= now:
+					del self.sessions[sess_id]
+
+class UserSessionSweeper(TimerThread):
+	"""
+	Periodically remove expired sessions from the database and the cache,
+	instead of doing so on every request
+	"""
+	KICK_PERIOD = LuxFireConfig.Instance().getint('Web', 'session_sweep_interval')
+	
+	def kick(self):
+		try:
+			UserSession.delete_old_sessions()
+		except Exception as err:
+			WebLog('Session sweep failed: %s' % err)
+		session_cache.purge()
+
+session_cache = UserSessionCache(LuxFireConfig.Instance().getint('Web', 'session_cache_ttl'))
+
+session_sweeper = None
+
+def start_session_sweeper():
+	"""
+	Start the UserSessionSweeper, once. This is done by the web server start
+	up code, so that merely importing this module starts no threads.
+	"""
+	global session_sweeper
+	if session_sweeper is None:
+		session_sweeper = UserSessionSweeper()
+		session_sweeper.daemon = True
+		session_sweeper.start()
+
 def get_user_session():
-	UserSession.delete_old_sessions()
+	"""Get the CachedUserSession of the current request"""
 	try:
 		sess_id = request.COOKIES.get('session_id', '') #@UndefinedVariable
-		user_session = LuxFireWeb._db.query(UserSession).options(eagerload('user')).filter(UserSession.sess_id==sess_id).one()
-		return user_session
+		return session_cache.get(sess_id)
 	except:
 		raise ClientException('No active user session')
 
 def create_session_key():
 	return hashlib.md5( ('%s'%(time.time()*random.random())).encode() ).hexdigest()
 
-def set_dispatcher_key():
+def set_dispatcher_key(scope=''):
 	"""
-	This method will set a key in the current user session
+	This method will make a signed, single-use key for the current user
+	(or a key for all the calls in scope, see DispatcherToken)
 	so that method calls on the Dispatcher can verify that
 	the commands came from a logged in user, and not from
 	other network traffic pretending to be a user.
@@ -95,12 +185,7 @@ def set_dispatcher_key():
 	"""
 	
 	u_session = get_user_session()
-	dk = create_session_key()
-	u_session.session_data['dispatcher_key'] = dk
-	LuxFireWeb._db.add(u_session)
-	LuxFireWeb._db.flush()
-	
-	return dk
+	return DispatcherToken.Instance().sign(u_session.user_id, scope)
 
 # Provides @User.protected() decorator for access control
 # roles[] is a list of roles the user must have to access this route.
@@ -110,19 +195,10 @@ def protected(roles=['login']):
 		def wrapper(*a, **ka):
 			try:
 				u_session = get_user_session()
-				if not ('logged_in' in u_session.session_data.keys() and u_session.session_data['logged_in'] == True):
+				if not u_session.logged_in:
 					raise ClientException('Not logged in')
 				
-				role_check = False
-				for u_role in u_session.user.roles:
-					for c_role in roles:
-						if u_role.name == c_role:
-							role_check = True
-							break
-					if role_check:
-						break
-				
-				if not role_check:
+				if u_session.roles.isdisjoint(roles):
 					raise Exception('Insufficient privileges')
 				
 				return func(*a, **ka)
@@ -136,7 +212,7 @@ def get_user_queue_item():
 	"""Get the queue item belonging to the logged in user
 	and with ID == GET['q_id']"""
 	u_session = get_user_session()
-	return LuxFireWeb._db.query(Queue).filter(Queue.user_id==u_session.user.id).filter(Queue.id==request.POST.get('q_id')).one()	#@UndefinedVariable
+	return LuxFireWeb._db.query(Queue).filter(Queue.user_id==u_session.user_id).filter(Queue.id==request.POST.get('q_id')).one()	#@UndefinedVariable
 
 # ROUTES
 
@@ -164,7 +240,7 @@ def user_login_process():
 			user_session = UserSession()
 			user_session.sess_id = create_session_key()
 			user_session.user_id = user.id
-			user_session.session_data = {'logged_in':  True}
+			user_session.logged_in = True
 			user_session.expiry = datetime.timedelta(days=COOKIE_EXPIRE_DAYS) + datetime.datetime.now()
 			db.add(user_session)
 			response.set_cookie(
@@ -183,7 +259,8 @@ def user_logout():
 	try:
 		u_session = get_user_session()
 		db = LuxFireWeb._db
-		db.delete(u_session)
+		db.query(UserSession).filter(UserSession.sess_id==u_session.sess_id).delete()
+		session_cache.invalidate(u_session.sess_id)
 		response.set_cookie(
 			'session_id',
 			'',
@@ -199,13 +276,30 @@ def user_logout():
 def user_jobs():
 	try:
 		u_session = get_user_session()
-		uq = u_session.user.queue
-		ur = u_session.user.results
+		dispatcher = find_dispatcher()
+		
+		queue_before = request.GET.get('queue_before')	#@UndefinedVariable
+		results_before = request.GET.get('results_before')	#@UndefinedVariable
+		uq = ListRows(QueueListColumns, dispatcher.list_queue(
+			user_id=u_session.user_id,
+			before_id=int(queue_before) if queue_before else None,
+			limit=JOBS_PAGE_SIZE
+		))
+		ur = ListRows(ResultListColumns, dispatcher.list_results(
+			user_id=u_session.user_id,
+			before_id=int(results_before) if results_before else None,
+			limit=JOBS_PAGE_SIZE
+		))
 		return LuxFireWeb._templater.get_template('user_jobs.html').render(
 			user_queue=uq,
 			user_queue_length=len(uq),
+			user_queue_before=queue_before,
+			user_queue_older=uq[-1]['id'] if len(uq) == JOBS_PAGE_SIZE else None,
 			user_results=ur,
-			user_results_length=len(ur)
+			user_results_length=len(ur),
+			user_results_before=results_before,
+			user_results_older=ur[-1]['id'] if len(ur) == JOBS_PAGE_SIZE else None,
+			user_results_total=sum(dispatcher.count_results(u_session.user_id).values())
 		)
 	except ClientException as err:
 		return '%s' % err
@@ -261,7 +355,7 @@ def user_queue_new():
 		if haltspp < 1 and halttime < 1:
 			raise Exception('You must specify at least one halt condition.')
 		
-		dispatcher.add_queue(u_session.user.id, set_dispatcher_key(), jobname, haltspp, halttime)
+		dispatcher.add_queue(u_session.user_id, set_dispatcher_key(), jobname, haltspp, halttime)
 		
 		return {'success':True}
 	except Exception as err:
@@ -277,7 +371,48 @@ def user_queue_upload():
 		filename = request.GET.get('qqfile')	#@UndefinedVariable
 		filedata = request.body
 		
-		if dispatcher.add_file(q.user_id, set_dispatcher_key(), q.jobname, filename, filedata.read()):
+		chunk_size = LuxFireConfig.Instance().getint('Web', 'upload_chunk_size')
+		
+		filedata.seek(0, os.SEEK_END)
+		size = filedata.tell()
+		filedata.seek(0)
+		chunk = filedata.read(chunk_size)
+		
+		# Resume a previously interrupted upload of the same file. The
+		# Dispatcher starts again from 0 if the size or first chunk differ
+		# from those of the interrupted upload; data already held by the
+		# Dispatcher is still hashed, so commit_file() will reject it if it
+		# does not match this upload
+		# One key for all the calls of this upload
+		upload_key = set_dispatcher_key(DispatcherToken.upload_scope(q.jobname, filename))
+		
+		resume_offset = dispatcher.get_file_offset(
+			q.user_id, upload_key, q.jobname, filename,
+			size, hashlib.sha1(chunk).hexdigest()
+		)
+		
+		h = hashlib.sha1()
+		offset = 0
+		while chunk:
+			h.update(chunk)
+			chunk_end = offset + len(chunk)
+			if chunk_end > resume_offset:
+				if offset < resume_offset:
+					chunk = chunk[resume_offset-offset:]
+					offset = resume_offset
+				offset = dispatcher.add_file_chunk(
+					q.user_id, upload_key, q.jobname, filename,
+					offset, chunk, hashlib.sha1(chunk).hexdigest()
+				)
+			else:
+				offset = chunk_end
+			chunk = filedata.read(chunk_size)
+		
+		if offset == 0:
+			# Empty file
+			dispatcher.add_file_chunk(q.user_id, upload_key, q.jobname, filename, 0, b'', h.hexdigest())
+		
+		if dispatcher.commit_file(q.user_id, upload_key, q.jobname, filename, offset, h.hexdigest()):
 			return {'success':True}
 		
 		raise Exception('Error sending file to Dispatcher')
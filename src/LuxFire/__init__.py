@@ -44,6 +44,23 @@ DefaultConfig = {
 		# Default bind address is localhost only, services will not be broadcast!
 		'bind': '127.0.0.1',
 		'database': 'sqlite:///db_luxfire.sqlite3',
+		# Seconds to wait for a locked SQLite database, and the number of
+		# times a locked transaction is tried again after that
+		'database_busy_timeout': '30',
+		'database_retries': '5',
+		# Secret shared by the web interface and the Dispatcher to sign the
+		# tokens of user requests, the seconds a token is valid for (a whole
+		# file upload uses one token), and the number of used tokens the
+		# Dispatcher remembers to refuse replays
+		'dispatcher_secret': '',
+		'dispatcher_token_ttl': '60',
+		'dispatcher_upload_token_ttl': '3600',
+		'dispatcher_token_cache': '100000',
+		# Pyro transport server: thread, select or asyncio
+		'pyro_servertype': 'thread',
+		# Seconds a service stays registered in the nameserver without
+		# renewing its lease
+		'ns_lease_ttl': '30',
 	},
 	'LocalStorage': {
 		# Configurable per platform.system()
@@ -53,6 +70,8 @@ DefaultConfig = {
 	},
 	'NetworkStorage': {
 		'type': 'mounted_filesystem',
+		# Distribute files through a deduplicated store in NetworkStorage
+		'content_store': 'true',
 		
 		# Configurable per platform.system()
 		'linux': '/mnt/network_location/LuxFire',
@@ -60,14 +79,46 @@ DefaultConfig = {
 		'windows': 'N:/LuxFire'
 	},
 	'Dispatcher': {
+		# Process the Queue when it changes, rather than only at intervals
+		'event_driven': 'true',
+		# Interval between Queue processing when event_driven is enabled
+		'safety_interval': '60',
+		# Interval between Queue processing when event_driven is disabled
 		'process_interval': '5',
 		'max_items_per_worker': '10',
+		# Seconds a Dispatcher keeps the Queue items it handles to itself,
+		# so that several Dispatchers can share one database. Must be
+		# longer than safety_interval, leases are renewed on every pass
+		'lease_ttl': '180',
+		# Number of threads distributing data and starting Renderers, and the
+		# number of jobs each of them may have waiting
+		'distribute_workers': '2',
+		'render_start_workers': '4',
+		'max_queued_jobs': '100',
+		# Split items with a large haltspp across up to this many Renderers
+		# (1 = never split), merge their films with film_merger and write
+		# the merged film's images with film_tonemapper
+		'split_renderers': '1',
+		'split_min_haltspp': '1024',
+		'film_merger': 'luxmerger',
+		'film_tonemapper': 'luxconsole',
+		# Move Results older than archive_after_days (0 = never) into
+		# compressed files in archive_path, checking every archive_interval
+		'archive_after_days': '90',
+		'archive_interval': '3600',
+		'archive_path': '../archive',
 	},
 	'Renderer': {
 		'threads_per_server': '4'
 	},
 	'Web': {
-		'port': '9080'
+		'port': '9080',
+		# Size of the chunks uploaded files are sent to the Dispatcher in
+		'upload_chunk_size': '1048576',
+		# Seconds a user session is kept in memory before being read from
+		# the database again, and between removals of expired sessions
+		'session_cache_ttl': '60',
+		'session_sweep_interval': '600',
 	},
 }
 
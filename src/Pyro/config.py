@@ -10,8 +10,18 @@ NS_HOST       =  HOST
 NS_PORT       =  9090     # tcp
 NS_BCPORT     =  9091     # udp
 NS_BCHOST     =  None
+NS_CACHE_TTL  =  60.0     # seconds a resolved PYRONAME is remembered, 0=don't cache
+NS_CACHE_NEGATIVE_TTL = 5.0    # seconds a failed name lookup is remembered
+NS_CHANGELOG_SIZE = 1000     # name server changes remembered for changes_since()
+NS_LEASE_CHECKINTERVAL = 1.0   # seconds between evictions of names whose lease ran out
 COMPRESSION   =  False
-SERVERTYPE    =  "thread"
+COMPRESSOR    =  "lz4"      # preferred compressor, "lz4", "zstd" or "zlib" (used if the others aren't available)
+COMPRESSION_LEVEL = 1       # zlib compression level
+COMPRESSION_THRESHOLD = 4096     # messages smaller than this are never compressed
+COMPRESSION_MINSAVING = 0.1      # back off compressing a method's messages if they shrink less than this
+SERIALIZER    =  "binary"   # preferred serializer, "binary" or "pickle"
+SERIALIZER_OOB_THRESHOLD = 65536    # bytes objects this size or larger are sent out-of-band
+SERVERTYPE    =  "thread"   # "thread", "select" or "asyncio"
 DOTTEDNAMES   =  False    # server-side 
 COMMTIMEOUT   =  0.0
 POLLTIMEOUT   =  2.0      # seconds
@@ -22,6 +32,10 @@ CONNECTHANDSHAKE   = True     # should a connection handshake be done?
 THREADPOOL_MINTHREADS  = 4
 THREADPOOL_MAXTHREADS  = 50
 THREADPOOL_IDLETIMEOUT = 5.0
+PROXYPOOL_MAXCONNECTIONS = 4     # max connections per PooledProxy
+PROXYPOOL_MAXIDLE = 2     # max idle connections a PooledProxy keeps open
+PROXYPOOL_IDLETIMEOUT = 10.0     # seconds before an idle PooledProxy connection is closed
+ASYNCIO_WORKERS = 16     # threads running method calls for the asyncio server, 0=run them in the event loop
 
 
 # Btw, env vars only used at package import time (see __init__.py):
@@ -7,7 +7,7 @@ irmen@razorvine.net - http://www.razorvine.net/python/Pyro
 
 from __future__ import with_statement
 import re, struct, sys, time, os
-import logging, uuid
+import logging, uuid, weakref
 import Pyro.config
 import Pyro.socketutil
 import Pyro.util
@@ -125,7 +125,7 @@ class _RemoteMethod(object):
 class Proxy(object):
     """Pyro proxy for a remote object. Intercepts method calls and dispatches them to the remote object."""
     _pyroSerializer=Pyro.util.Serializer()
-    __pyroAttributes=frozenset(["__getnewargs__","__getinitargs__","_pyroConnection","_pyroUri","_pyroOneway","_pyroTimeout"])
+    __pyroAttributes=frozenset(["__getnewargs__","__getinitargs__","_pyroConnection","_pyroUri","_pyroOneway","_pyroTimeout","_pyroCompression"])
     def __init__(self, uri):
         if isinstance(uri, basestring):
             uri=URI(uri)
@@ -134,8 +134,11 @@ class Proxy(object):
         self._pyroUri=uri
         self._pyroConnection=None
         self._pyroOneway=set()
+        self._pyroCompression=Pyro.util.CompressionPolicy()
         self.__pyroTimeout=Pyro.config.COMMTIMEOUT
         self.__pyroLock=threadutil.Lock()
+        self.__pyroSerializerId=0
+        self.__pyroCompressorId=0
     def __del__(self):
         if hasattr(self,"_pyroConnection"):
             self._pyroRelease()
@@ -149,11 +152,13 @@ class Proxy(object):
     def __unicode__(self):
         return str(self)
     def __getstate__(self):
-        return self._pyroUri,self._pyroOneway,self._pyroSerializer,self.__pyroTimeout    # skip the connection
+        return self._pyroUri,self._pyroOneway,self._pyroSerializer,self.__pyroTimeout,self._pyroCompression    # skip the connection
     def __setstate__(self, state):
-        self._pyroUri,self._pyroOneway,self._pyroSerializer,self.__pyroTimeout = state
+        self._pyroUri,self._pyroOneway,self._pyroSerializer,self.__pyroTimeout,self._pyroCompression = state
         self._pyroConnection=None
         self.__pyroLock=threadutil.Lock()
+        self.__pyroSerializerId=0
+        self.__pyroCompressorId=0
     def __copy__(self):
         uriCopy=URI(self._pyroUri)
         return Proxy(uriCopy)
@@ -183,20 +188,30 @@ class Proxy(object):
             self._pyroConnection.timeout=timeout
     _pyroTimeout=property(__pyroGetTimeout, __pyroSetTimeout)
 
-    def __pyroInvoke(self, methodname, vargs, kwargs):
+    def _pyroInvokeBatch(self, calls):
+        """Perform a list of (methodname, vargs, kwargs) calls in a single round trip.
+        Returns the list of their results. See batch()."""
+        return self.__pyroInvoke(BATCH_METHODNAME, calls, {}, MessageFactory.FLAGS_BATCH)
+
+    def __pyroInvoke(self, methodname, vargs, kwargs, flags=0):
         """perform the remote method call communication"""
         if not self._pyroConnection:
             # rebind here, don't do it from inside the invoke because deadlock will occur
             self.__pyroCreateConnection()
-        data,compressed=self._pyroSerializer.serialize( 
-            (self._pyroConnection.objectId,methodname,vargs,kwargs), compress=Pyro.config.COMPRESSION )
-        flags=0
+        serializer=Pyro.util.getSerializer(self.__pyroSerializerId)
+        compressor=Pyro.util.getCompressor(self.__pyroCompressorId)
+        parts,compressed=serializer.serializeParts( 
+            (self._pyroConnection.objectId,methodname,vargs,kwargs) )
+        parts,compressed=self._pyroCompression.compress(compressor, methodname, parts)
+        flags|=MessageFactory.serializerFlags(serializer.serializerId) | MessageFactory.compressorFlags(compressor.compressorId)
         if compressed:
             flags |= MessageFactory.FLAGS_COMPRESSED
+        if self._pyroCompression.wants(methodname):
+            flags |= MessageFactory.FLAGS_COMPRESS_REPLY
         if methodname in self._pyroOneway:
             flags |= MessageFactory.FLAGS_ONEWAY
         with self.__pyroLock:
-            data=MessageFactory.createMessage(MessageFactory.MSG_INVOKE, data, flags)
+            data=MessageFactory.createMessageParts(MessageFactory.MSG_INVOKE, parts, flags)
             try:
                 self._pyroConnection.send(data)
                 if flags & MessageFactory.FLAGS_ONEWAY:
@@ -209,7 +224,10 @@ class Proxy(object):
                         log.error(err)
                         raise Pyro.errors.ProtocolError(err)
                     data=self._pyroConnection.recv(dataLen)
-                    data=self._pyroSerializer.deserialize(data, compressed=flags & MessageFactory.FLAGS_COMPRESSED)
+                    if flags & MessageFactory.FLAGS_COMPRESSED:
+                        data=Pyro.util.getCompressor(MessageFactory.compressorId(flags)).decompress(data)
+                    serializer=Pyro.util.getSerializer(MessageFactory.serializerId(flags))
+                    data=serializer.deserialize(data)
                     if flags & MessageFactory.FLAGS_EXCEPTION:
                         raise data
                     else:
@@ -232,13 +250,17 @@ class Proxy(object):
                 with self.__pyroLock:
                     sock=Pyro.socketutil.createSocket(connect=(uri.host, uri.port), timeout=self.__pyroTimeout)
                     conn=Pyro.socketutil.SocketConnection(sock, uri.object)
+                    serializerId,compressorId=0,0
                     if Pyro.config.CONNECTHANDSHAKE:
-                        # handshake
-                        data=MessageFactory.createMessage(MessageFactory.MSG_CONNECT, None, 0)
+                        # handshake, offering the serializers and compressors we support in order of preference
+                        data=MessageFactory.createMessage(MessageFactory.MSG_CONNECT, MessageFactory.connectOffer(), 0)
                         conn.send(data)
                         data=conn.recv(MessageFactory.HEADERSIZE)
                         msgType,flags,dataLen=MessageFactory.parseMessageHeader(data) #@UnusedVariable (pydev)
-                        # any trailing data (dataLen>0) is an error message, if any
+                        # any trailing data (dataLen>0) is an error message, if any,
+                        # or the chosen serializer and compressor for a MSG_CONNECTOK
+                        if msgType==MessageFactory.MSG_CONNECTOK and dataLen>0:
+                            serializerId,compressorId=MessageFactory.parseConnectReply(conn.recv(dataLen))
                     else:
                         msgType=MessageFactory.MSG_CONNECTOK
             except Exception:
@@ -261,6 +283,8 @@ class Proxy(object):
                     raise Pyro.errors.CommunicationError(error)
                 elif msgType==MessageFactory.MSG_CONNECTOK:
                     self._pyroConnection=conn
+                    self.__pyroSerializerId=serializerId
+                    self.__pyroCompressorId=compressorId
                     if replaceUri:
                         log.debug("replacing uri with bound one")
                         self._pyroUri=uri
@@ -288,6 +312,184 @@ class Proxy(object):
         raise Pyro.errors.ConnectionClosedError(msg)
 
 
+class PooledProxy(object):
+    """
+    Pyro proxy for a remote object, backed by a pool of connections to it. Method calls
+    from several threads at the same time each get their own connection and run
+    concurrently, instead of queueing up behind the single connection of a Proxy.
+    At most maxConnections connections are opened, other callers wait for a free one.
+    Connections are kept open between calls, but as a thread pool server ties up a
+    worker thread for every open connection, at most PROXYPOOL_MAXIDLE idle ones
+    are kept, and those that stay idle for PROXYPOOL_IDLETIMEOUT seconds are closed.
+    """
+    __pyroAttributes=frozenset(["__getnewargs__","__getinitargs__","_pyroUri","_pyroOneway","_pyroTimeout","_pyroMaxConnections","_pyroCompression"])
+    def __init__(self, uri, maxConnections=None):
+        if isinstance(uri, basestring):
+            uri=URI(uri)
+        elif not isinstance(uri, URI):
+            raise TypeError("expected Pyro URI")
+        self._pyroUri=uri
+        self._pyroOneway=set()
+        self._pyroCompression=Pyro.util.CompressionPolicy()
+        self._pyroMaxConnections=maxConnections or Pyro.config.PROXYPOOL_MAXCONNECTIONS
+        self.__pyroTimeout=Pyro.config.COMMTIMEOUT
+        self.__pyroInitPool()
+    def __pyroInitPool(self):
+        self.__pyroIdle=[]     # (proxy, time it became idle), most recently used last
+        self.__pyroCount=0
+        self.__pyroCondition=threadutil.Condition()
+        _IdleConnectionCloser.add(self)
+    def __del__(self):
+        if hasattr(self,"_PooledProxy__pyroIdle"):
+            self._pyroRelease()
+    def __getattr__(self, name):
+        if name in PooledProxy.__pyroAttributes or name.startswith("_PooledProxy__"):
+            # allows it to be safely pickled
+            raise AttributeError(name)
+        return _RemoteMethod(self.__pyroInvoke, name)
+    def __str__(self):
+        return "<Pyro PooledProxy for "+str(self._pyroUri)+">"
+    def __unicode__(self):
+        return str(self)
+    def __getstate__(self):
+        return self._pyroUri,self._pyroOneway,self._pyroMaxConnections,self.__pyroTimeout,self._pyroCompression    # skip the connections
+    def __setstate__(self, state):
+        self._pyroUri,self._pyroOneway,self._pyroMaxConnections,self.__pyroTimeout,self._pyroCompression = state
+        self.__pyroInitPool()
+    def __copy__(self):
+        uriCopy=URI(self._pyroUri)
+        return PooledProxy(uriCopy, self._pyroMaxConnections)
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._pyroRelease()
+
+    def _pyroRelease(self):
+        """release the idle connections to the pyro daemon"""
+        with self.__pyroCondition:
+            for proxy,since in self.__pyroIdle:
+                proxy._pyroRelease()
+
+    def _pyroCloseIdle(self, maxIdleTime):
+        """close the connections that have been idle for longer than maxIdleTime seconds"""
+        expired=time.time()-maxIdleTime
+        with self.__pyroCondition:
+            closing=[proxy for proxy,since in self.__pyroIdle if since<expired]
+            self.__pyroIdle=[(proxy,since) for proxy,since in self.__pyroIdle if since>=expired]
+            self.__pyroCount-=len(closing)
+            if closing:
+                self.__pyroCondition.notify()
+        for proxy in closing:
+            proxy._pyroRelease()
+
+    def __pyroGetTimeout(self):
+        return self.__pyroTimeout
+    def __pyroSetTimeout(self, timeout):
+        self.__pyroTimeout=timeout
+        with self.__pyroCondition:
+            for proxy,since in self.__pyroIdle:
+                proxy._pyroTimeout=timeout
+    _pyroTimeout=property(__pyroGetTimeout, __pyroSetTimeout)
+
+    def __pyroAcquire(self):
+        """get an idle connection from the pool, or a new one if the pool is not full yet"""
+        with self.__pyroCondition:
+            while not self.__pyroIdle and self.__pyroCount>=self._pyroMaxConnections:
+                self.__pyroCondition.wait()
+            if self.__pyroIdle:
+                proxy,since=self.__pyroIdle.pop()
+                proxy._pyroTimeout=self.__pyroTimeout
+                return proxy
+            self.__pyroCount+=1
+        proxy=Proxy(self._pyroUri)
+        proxy._pyroOneway=self._pyroOneway
+        proxy._pyroCompression=self._pyroCompression
+        proxy._pyroTimeout=self.__pyroTimeout
+        return proxy
+
+    def _pyroInvokeBatch(self, calls):
+        """Perform a list of (methodname, vargs, kwargs) calls in a single round trip,
+        on one of the pooled connections. Returns the list of their results. See batch()."""
+        return self.__pyroInvoke(BATCH_METHODNAME, calls, {}, MessageFactory.FLAGS_BATCH)
+
+    def __pyroInvoke(self, methodname, vargs, kwargs, flags=0):
+        """perform the remote method call on one of the pooled connections"""
+        proxy=self.__pyroAcquire()
+        try:
+            return proxy._Proxy__pyroInvoke(methodname, vargs, kwargs, flags)
+        finally:
+            surplus=None
+            with self.__pyroCondition:
+                self.__pyroIdle.append((proxy,time.time()))
+                if len(self.__pyroIdle)>Pyro.config.PROXYPOOL_MAXIDLE:
+                    surplus,since=self.__pyroIdle.pop(0)
+                    self.__pyroCount-=1
+                self.__pyroCondition.notify()
+            if surplus is not None:
+                surplus._pyroRelease()
+
+
+class _IdleConnectionCloser(object):
+    """
+    Closes the connections of all PooledProxies that stay idle for longer than
+    PROXYPOOL_IDLETIMEOUT, using a single background thread.
+    """
+    pools=weakref.WeakKeyDictionary()
+    lock=threadutil.Lock()
+    thread=None
+
+    @classmethod
+    def add(cls, pool):
+        with cls.lock:
+            cls.pools[pool]=None
+            if cls.thread is None:
+                cls.thread=threadutil.Thread(target=cls.run)
+                cls.thread.setDaemon(True)
+                cls.thread.start()
+
+    @classmethod
+    def run(cls):
+        while True:
+            time.sleep(max(Pyro.config.PROXYPOOL_IDLETIMEOUT/2.0, 0.05))
+            with cls.lock:
+                pools=list(cls.pools.keys())
+            for pool in pools:
+                pool._pyroCloseIdle(Pyro.config.PROXYPOOL_IDLETIMEOUT)
+            del pools
+
+
+BATCH_METHODNAME="<batch>"
+
+class BatchProxy(object):
+    """
+    Collects method calls made on it for a Pyro proxy, instead of performing them.
+    Calling the BatchProxy itself sends all the collected calls to the remote object
+    as a single message, and returns the list of their results from a single reply.
+    The calls are performed in order. If one of them raises an exception, the rest
+    are not performed and the exception is raised here; the results of the calls
+    performed before it are in its _pyroBatchResults attribute.
+    Oneway methods are performed like any other in a batch.
+    """
+    def __init__(self, proxy):
+        self.__proxy=proxy
+        self.__calls=[]
+    def __getattr__(self, name):
+        if name.startswith("_BatchProxy__"):
+            raise AttributeError(name)
+        return _RemoteMethod(self.__collect, name)
+    def __collect(self, methodname, vargs, kwargs):
+        self.__calls.append((methodname, vargs, kwargs))
+    def __call__(self):
+        calls,self.__calls=self.__calls,[]
+        if not calls:
+            return []
+        return self.__proxy._pyroInvokeBatch(calls)
+
+def batch(proxy):
+    """Create a BatchProxy to collect calls for the given Proxy or PooledProxy"""
+    return BatchProxy(proxy)
+
+
 class MessageFactory(object):
     """internal helper class to construct Pyro protocol messages"""
     headerFmt = '!4sHHHi'    # header (id, version, msgtype, flags, dataLen)
@@ -300,6 +502,13 @@ class MessageFactory(object):
     FLAGS_EXCEPTION  = 1<<0
     FLAGS_COMPRESSED = 1<<1
     FLAGS_ONEWAY     = 1<<2
+    FLAGS_COMPRESS_REPLY = 1<<3     # the caller would like the result compressed
+    FLAGS_BATCH      = 1<<4     # the arguments are a list of (method, vargs, kwargs) calls
+    FLAGS_SERIALIZER_SHIFT = 8      # bits 8-11 hold the id of the serializer used
+    FLAGS_SERIALIZER_MASK  = 0x0f<<8
+    FLAGS_COMPRESSOR_SHIFT = 12     # bits 12-15 hold the id of the compressor used, or to use for the reply
+    FLAGS_COMPRESSOR_MASK  = 0x0f<<12
+    CONNECT_SEPARATOR = 0xff
     if sys.version_info>=(3,0):
         empty_bytes  = bytes([])
         pyro_tag     = bytes("PYRO","ASCII")
@@ -314,6 +523,14 @@ class MessageFactory(object):
         msg=struct.pack(cls.headerFmt, cls.pyro_tag, Pyro.constants.PROTOCOL_VERSION, msgType, flags, len(data))
         return msg+data
 
+    @classmethod
+    def createMessageParts(cls, msgType, parts, flags=0):
+        """creates a message as a list of buffers: the header followed by the given data buffers.
+        This avoids copying the data just to put the header in front of it."""
+        dataLen=sum(len(part) for part in parts)
+        header=struct.pack(cls.headerFmt, cls.pyro_tag, Pyro.constants.PROTOCOL_VERSION, msgType, flags, dataLen)
+        return [header]+list(parts)
+
     @classmethod
     def parseMessageHeader(cls, headerData):
         """Parses a message header. Returns a tuple of messagetype, messageflags, datalength.""" 
@@ -324,6 +541,53 @@ class MessageFactory(object):
             raise Pyro.errors.ProtocolError("invalid data or unsupported protocol version")
         return msgType,flags,dataLen
 
+    @classmethod
+    def serializerFlags(cls, serializerId):
+        """the message flags indicating the given serializer"""
+        return serializerId<<cls.FLAGS_SERIALIZER_SHIFT
+
+    @classmethod
+    def serializerId(cls, flags):
+        """the id of the serializer indicated by the message flags"""
+        return (flags & cls.FLAGS_SERIALIZER_MASK)>>cls.FLAGS_SERIALIZER_SHIFT
+
+    @classmethod
+    def compressorFlags(cls, compressorId):
+        """the message flags indicating the given compressor"""
+        return compressorId<<cls.FLAGS_COMPRESSOR_SHIFT
+
+    @classmethod
+    def compressorId(cls, flags):
+        """the id of the compressor indicated by the message flags"""
+        return (flags & cls.FLAGS_COMPRESSOR_MASK)>>cls.FLAGS_COMPRESSOR_SHIFT
+
+    @classmethod
+    def connectOffer(cls):
+        """MSG_CONNECT data: the ids of the serializers we support, preferred first,
+        a separator, and the ids of the compressors we support, preferred first"""
+        ids=Pyro.util.preferredSerializerIds()+[cls.CONNECT_SEPARATOR]+Pyro.util.preferredCompressorIds()
+        return struct.pack("!%dB" % len(ids), *ids)
+
+    @classmethod
+    def connectChoice(cls, data):
+        """pick the first serializer and compressor in a MSG_CONNECT offer that we support.
+        Returns the MSG_CONNECTOK data with their ids."""
+        offer=list(struct.unpack("!%dB" % len(data), data))
+        if cls.CONNECT_SEPARATOR in offer:
+            serializers=offer[:offer.index(cls.CONNECT_SEPARATOR)]
+            compressors=offer[offer.index(cls.CONNECT_SEPARATOR)+1:]
+        else:
+            serializers,compressors=offer,[]
+        serializerId=([i for i in serializers if i in Pyro.util.preferredSerializerIds()]+[0])[0]
+        compressorId=([i for i in compressors if i in Pyro.util.preferredCompressorIds()]+[0])[0]
+        return struct.pack("!BB", serializerId, compressorId)
+
+    @classmethod
+    def parseConnectReply(cls, data):
+        """the serializer id and compressor id from the MSG_CONNECTOK data"""
+        serializerId,compressorId=struct.unpack("!BB", data[:2])
+        return serializerId,compressorId
+
 
 class DaemonObject(object):
     """The part of the daemon that is exposed as a Pyro object."""
@@ -349,11 +613,16 @@ class Daemon(object):
             self.transportServer=SocketServer_Threadpool(self, host, port, Pyro.config.COMMTIMEOUT)
         elif Pyro.config.SERVERTYPE=="select":
             self.transportServer=SocketServer_Select(self, host, port, Pyro.config.COMMTIMEOUT)
+        elif Pyro.config.SERVERTYPE=="asyncio":
+            # not imported globally, asyncio isn't available on older Pythons
+            from Pyro.socketserver.asyncioserver import SocketServer_Asyncio
+            self.transportServer=SocketServer_Asyncio(self, host, port, Pyro.config.COMMTIMEOUT)
         else:
             raise Pyro.errors.PyroError("invalid server type '%s'" % Pyro.config.SERVERTYPE)
         self.locationStr=self.transportServer.locationStr
         log.debug("created daemon on %s", self.locationStr) 
         self.serializer=Pyro.util.Serializer()
+        self.compression=Pyro.util.CompressionPolicy()
         pyroObject=DaemonObject(self)
         pyroObject._pyroId=Pyro.constants.DAEMON_NAME
         self.objectsById={pyroObject._pyroId: pyroObject}
@@ -412,9 +681,11 @@ class Daemon(object):
             err="expected MSG_CONNECT message, got %d" % msgType
             log.warn(err)
             raise Pyro.errors.ProtocolError(err)
+        data=None
         if dataLen>0:
-            conn.recv(dataLen) # read away any trailing data (unused at the moment)
-        msg=MessageFactory.createMessage(MessageFactory.MSG_CONNECTOK,None,0)
+            # the client offers its serializers and compressors, reply with the ones to use
+            data=MessageFactory.connectChoice(conn.recv(dataLen))
+        msg=MessageFactory.createMessage(MessageFactory.MSG_CONNECTOK,data,0)
         conn.send(msg)
         return True
 
@@ -425,6 +696,7 @@ class Daemon(object):
         terminate due to exceptions caused by remote invocations.
         """
         flags=0
+        serializer=self.serializer
         isCallback=False
         try:
             header=conn.recv(MessageFactory.HEADERSIZE)
@@ -434,10 +706,16 @@ class Daemon(object):
                 log.warn(err)
                 raise Pyro.errors.ProtocolError(err)
             data=conn.recv(dataLen)
-            objId, method, vargs, kwargs=self.serializer.deserialize(
-                                           data,compressed=flags & MessageFactory.FLAGS_COMPRESSED)
+            # reply with the same serializer and compressor as the request
+            serializer=Pyro.util.getSerializer(MessageFactory.serializerId(flags))
+            compressor=Pyro.util.getCompressor(MessageFactory.compressorId(flags))
+            if flags & MessageFactory.FLAGS_COMPRESSED:
+                data=compressor.decompress(data)
+            objId, method, vargs, kwargs=serializer.deserialize(data)
             obj=self.objectsById.get(objId)
-            if obj is not None:
+            if obj is not None and flags & MessageFactory.FLAGS_BATCH:
+                data=self.handleBatch(obj, vargs)
+            elif obj is not None:
                 if kwargs and sys.version_info<(2,6,5) and os.name!="java":
                     # Python before 2.6.5 doesn't accept unicode keyword arguments
                     kwargs = dict((str(k),kwargs[k]) for k in kwargs)
@@ -457,12 +735,15 @@ class Daemon(object):
             if flags & MessageFactory.FLAGS_ONEWAY:
                 return   # oneway call, don't send a response
             else:
-                data,compressed=self.serializer.serialize(data,compress=Pyro.config.COMPRESSION)
-                flags=0
+                parts,compressed=serializer.serializeParts(data)
+                # compress the result if the caller asked for it, or our own policy says so
+                wanted=flags & MessageFactory.FLAGS_COMPRESS_REPLY or self.compression.wants(method)
+                parts,compressed=self.compression.compress(compressor, method, parts, wanted)
+                flags=MessageFactory.serializerFlags(serializer.serializerId) | MessageFactory.compressorFlags(compressor.compressorId)
                 if compressed:
                     flags |= MessageFactory.FLAGS_COMPRESSED
-                msg=MessageFactory.createMessage(MessageFactory.MSG_RESULT, data, flags)
-                del data
+                msg=MessageFactory.createMessageParts(MessageFactory.MSG_RESULT, parts, flags)
+                del data,parts
                 conn.send(msg)
         except Pyro.errors.CommunicationError:
             # communication errors are not handled here (including TimeoutError)
@@ -474,15 +755,34 @@ class Daemon(object):
             if not flags & MessageFactory.FLAGS_ONEWAY:
                 # only return the error to the client if it wasn't a oneway call
                 tblines=Pyro.util.formatTraceback(detailed=Pyro.config.DETAILED_TRACEBACK)
-                self.sendExceptionResponse(conn, x, tblines)
+                self.sendExceptionResponse(conn, x, tblines, serializer)
             if isCallback:
                 raise       # re-raise if flagged as callback
 
-    def sendExceptionResponse(self, connection, exc_value, tbinfo):
+    def handleBatch(self, obj, calls):
+        """Perform the calls of a batch message on the object, in order. Returns the list of results.
+        If a call raises an exception, the results so far are attached to it, and it is passed on."""
+        results=[]
+        for method, vargs, kwargs in calls:
+            if kwargs and sys.version_info<(2,6,5) and os.name!="java":
+                # Python before 2.6.5 doesn't accept unicode keyword arguments
+                kwargs = dict((str(k),kwargs[k]) for k in kwargs)
+            try:
+                func=Pyro.util.resolveDottedAttribute(obj,method,Pyro.config.DOTTEDNAMES)
+                results.append(func(*vargs,**kwargs))
+            except Exception:
+                x=sys.exc_info()[1]
+                x._pyroBatchResults=results
+                raise
+        return results
+
+    def sendExceptionResponse(self, connection, exc_value, tbinfo, serializer=None):
         """send an exception back including the local traceback info"""
         setattr(exc_value, Pyro.constants.TRACEBACK_ATTRIBUTE, tbinfo)
-        data,_=self.serializer.serialize(exc_value)
-        msg=MessageFactory.createMessage(MessageFactory.MSG_RESULT, data, MessageFactory.FLAGS_EXCEPTION)
+        serializer=serializer or self.serializer
+        data,_=serializer.serialize(exc_value)
+        flags=MessageFactory.FLAGS_EXCEPTION | MessageFactory.serializerFlags(serializer.serializerId)
+        msg=MessageFactory.createMessage(MessageFactory.MSG_RESULT, data, flags)
         del data
         connection.send(msg)
 
@@ -6,14 +6,14 @@ irmen@razorvine.net - http://www.razorvine.net/python/Pyro
 """
 
 from __future__ import with_statement
-import re, logging, socket, sys
-from Pyro.threadutil import RLock, Thread
+import re, logging, socket, sys, time, bisect, collections
+from Pyro.threadutil import Lock, RLock, Condition, Event, Thread
 import Pyro.core        # not Pyro.core, to avoid circular import
 import Pyro.constants
 import Pyro.socketutil
-from Pyro.errors import PyroError, NamingError
+from Pyro.errors import PyroError, NamingError, CommunicationError
 
-__all__=["locateNS","resolve"]
+__all__=["locateNS","sharedNS","resolve","NameCache"]
 
 if sys.version_info>=(3,0):
     basestring=str
@@ -21,16 +21,31 @@ if sys.version_info>=(3,0):
 log=logging.getLogger("Pyro.naming")
 
 class NameServer(object):
-    """Pyro name server. Provides a simple flat name space to map logical object names to Pyro URIs."""
+    """
+    Pyro name server. Provides a simple flat name space to map logical object names to Pyro URIs.
+    The names are kept in sorted order as well, so prefix queries don't have to scan the whole
+    name space. Every change to the name space increases its version number, and clients can
+    ask for the changes since a version they've seen with changes_since() instead of listing
+    everything again.
+    Names can be registered with a lease of ttl seconds, they are evicted by evict() unless
+    the lease is renewed before it runs out. This cleans up after servers that went away
+    without removing their names.
+    """
     def __init__(self):
         self.namespace={}
+        self.names=[]
+        self.leases={}
         self.lock=RLock()
+        self.changed=Condition(self.lock)
+        # start at the clock so versions keep increasing when the name server is restarted
+        self.version=int(time.time()*1000)
+        self.changes=collections.deque(maxlen=Pyro.config.NS_CHANGELOG_SIZE)
     def lookup(self,arg):
         try:
             return Pyro.core.URI(self.namespace[arg])
         except KeyError:
             raise NamingError("unknown name: "+arg)
-    def register(self,name,uri):
+    def register(self,name,uri,ttl=None):
         if isinstance(uri, Pyro.core.URI):
             uri=uri.asString()
         elif not isinstance(uri, basestring):
@@ -39,40 +54,54 @@ class NameServer(object):
             Pyro.core.URI(uri)  # check if uri is valid
         if not isinstance(name, basestring):
             raise TypeError("name must be a str")
-        if name in self.namespace:
-            raise NamingError("name already registered: "+name)
         with self.lock:
+            if name in self.namespace:
+                raise NamingError("name already registered: "+name)
             self.namespace[name]=uri
+            bisect.insort(self.names, name)
+            if ttl:
+                self.leases[name]=time.time()+ttl
+            self.__changed(name, uri)
+    def renew(self, name, ttl):
+        """Renew the lease of a name for another ttl seconds. Returns False if the name is
+        not registered (anymore), in that case it has to be registered again."""
+        with self.lock:
+            if name not in self.namespace:
+                return False
+            self.leases[name]=time.time()+ttl
+            return True
+    def evict(self):
+        """Remove the names whose lease has run out, returns the number of names removed."""
+        now=time.time()
+        with self.lock:
+            expired=[name for name,expiry in self.leases.items() if expiry<=now]
+            for name in expired:
+                log.info("lease expired, removing %s",name)
+                self.__remove(name)
+            return len(expired)
     def remove(self, name=None, prefix=None, regex=None):
-        if name and name in self.namespace and name!=Pyro.constants.NAMESERVER_NAME:
-            with self.lock:
-                del self.namespace[name]
-            return 1
-        if prefix:
-            with self.lock:
+        with self.lock:
+            if name and name in self.namespace and name!=Pyro.constants.NAMESERVER_NAME:
+                self.__remove(name)
+                return 1
+            if prefix:
                 items=list(self.list(prefix=prefix).keys())
-                if Pyro.constants.NAMESERVER_NAME in items:
-                    items.remove(Pyro.constants.NAMESERVER_NAME)
-                for item in items:
-                    del self.namespace[item]
-                return len(items)
-        if regex:
-            with self.lock:
+            elif regex:
                 items=list(self.list(regex=regex).keys())
-                if Pyro.constants.NAMESERVER_NAME in items:
-                    items.remove(Pyro.constants.NAMESERVER_NAME)
-                for item in items:
-                    del self.namespace[item]
-                return len(items)
-        return 0
+            else:
+                return 0
+            if Pyro.constants.NAMESERVER_NAME in items:
+                items.remove(Pyro.constants.NAMESERVER_NAME)
+            for item in items:
+                self.__remove(item)
+            return len(items)
 
     def list(self, prefix=None, regex=None):
         with self.lock:
             if prefix:
                 result={}
-                for name in self.namespace:
-                    if name.startswith(prefix):
-                        result[name]=self.namespace[name]
+                for name in self.__prefixed(prefix):
+                    result[name]=self.namespace[name]
                 return result
             elif regex:
                 result={}
@@ -89,9 +118,50 @@ class NameServer(object):
             else:
                 # just return (a copy of) everything
                 return self.namespace.copy()
+    def changes_since(self, version=None, prefix=None, timeout=0):
+        """
+        Get the changes to the name space since the given version, optionally only those
+        for names starting with prefix. Returns (version, changes, complete): the current version,
+        and a dict of name: uri with None for removed names. If the given version is None or too
+        old to know its changes, complete is True and changes holds all (prefixed) names instead.
+        If there are no changes yet, waits at most timeout seconds for one to happen.
+        """
+        with self.lock:
+            if timeout and version==self.version:
+                waitUntil=time.time()+timeout
+                while version==self.version:
+                    remaining=waitUntil-time.time()
+                    if remaining<=0:
+                        break
+                    self.changed.wait(remaining)
+            if version is None or version>self.version or not self.changes or version<self.changes[0][0]-1:
+                return self.version, self.list(prefix=prefix), True
+            result={}
+            for changeVersion,name,uri in reversed(self.changes):
+                if changeVersion<=version:
+                    break
+                if name not in result and (not prefix or name.startswith(prefix)):
+                    result[name]=uri
+            return self.version, result, False
     def ping(self):
         pass
 
+    def __prefixed(self, prefix):
+        """the names starting with prefix, from the sorted index"""
+        index=bisect.bisect_left(self.names, prefix)
+        while index<len(self.names) and self.names[index].startswith(prefix):
+            yield self.names[index]
+            index+=1
+    def __remove(self, name):
+        del self.namespace[name]
+        del self.names[bisect.bisect_left(self.names, name)]
+        self.leases.pop(name, None)
+        self.__changed(name, None)
+    def __changed(self, name, uri):
+        self.version+=1
+        self.changes.append((self.version, name, uri))
+        self.changed.notify_all()
+
 
 class NameServerDaemon(Pyro.core.Daemon):
     """Daemon that contains the Name Server."""
@@ -106,8 +176,16 @@ class NameServerDaemon(Pyro.core.Daemon):
         self.nameserver=NameServer()
         self.register(self.nameserver, Pyro.constants.NAMESERVER_NAME)
         self.nameserver.register(Pyro.constants.NAMESERVER_NAME, self.uriFor(self.nameserver))
+        self.evictionStop=Event()
+        evictionThread=Thread(target=self.__evictionLoop, args=(self.nameserver,))
+        evictionThread.setDaemon(True)
+        evictionThread.start()
         log.info("nameserver daemon created")
+    def __evictionLoop(self, nameserver):
+        while not self.evictionStop.wait(Pyro.config.NS_LEASE_CHECKINTERVAL):
+            nameserver.evict()
     def close(self):
+        self.evictionStop.set()
         super(NameServerDaemon,self).close()
         self.nameserver=None
     def __enter__(self):
@@ -115,6 +193,7 @@ class NameServerDaemon(Pyro.core.Daemon):
             raise PyroError("cannot reuse this object")
         return self
     def __exit__(self, exc_type, exc_value, traceback):
+        self.evictionStop.set()
         self.nameserver=None
         return super(NameServerDaemon,self).__exit__(exc_type, exc_value, traceback)
         
@@ -262,8 +341,94 @@ def locateNS(host=None, port=None):
         
     
 
+class NameCache(object):
+    """
+    Thread safe cache of name lookups. Entries expire after ttl seconds.
+    Lookups that failed with a NamingError are remembered for negativeTtl seconds,
+    and fail again with the same message until then.
+    """
+    def __init__(self, ttl=None, negativeTtl=None):
+        self.ttl=Pyro.config.NS_CACHE_TTL if ttl is None else ttl
+        self.negativeTtl=Pyro.config.NS_CACHE_NEGATIVE_TTL if negativeTtl is None else negativeTtl
+        self.entries={}
+        self.lock=Lock()
+    def get(self, key, fetch):
+        """Return the cached value for key, or call fetch() to get it and cache it."""
+        now=time.time()
+        with self.lock:
+            entry=self.entries.get(key)
+        if entry is not None and entry[0]>now:
+            expiry,value,error=entry
+            if error is not None:
+                raise NamingError(error)
+            return value
+        try:
+            value=fetch()
+        except NamingError:
+            x=sys.exc_info()[1]
+            if self.negativeTtl>0:
+                with self.lock:
+                    self.entries[key]=(now+self.negativeTtl, None, str(x))
+            raise
+        if self.ttl>0:
+            with self.lock:
+                self.entries[key]=(now+self.ttl, value, None)
+        return value
+    def invalidate(self, key=None):
+        """Forget the entry for key, or all entries if key is None."""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+_sharedNameServers={}
+_sharedNameServersLock=Lock()
+_nameCache=NameCache()
+
+def sharedNS(host=None, port=None):
+    """
+    Get a proxy for the name server that is shared by the whole process, and kept
+    for later calls so the name server isn't located over and over again.
+    The proxy can be used by several threads at the same time.
+    """
+    with _sharedNameServersLock:
+        proxy=_sharedNameServers.get((host,port))
+        if proxy is None:
+            located=locateNS(host, port)
+            proxy=Pyro.core.PooledProxy(located._pyroUri)
+            located._pyroRelease()
+            _sharedNameServers[(host,port)]=proxy
+        return proxy
+
+def forgetNS(host=None, port=None):
+    """Forget the shared name server proxy, the next sharedNS() call will locate it again."""
+    with _sharedNameServersLock:
+        proxy=_sharedNameServers.pop((host,port), None)
+    if proxy is not None:
+        proxy._pyroRelease()
+
+def clearCache():
+    """Forget all cached name lookups made by resolve()."""
+    _nameCache.invalidate()
+
+def _lookup(host, port, name):
+    # a short-lived connection of its own, so that the shared proxy's connections
+    # are left alone and none is kept to tie up a worker thread of the name server
+    try:
+        with Pyro.core.Proxy(sharedNS(host, port)._pyroUri) as nameserver:
+            return nameserver.lookup(name)
+    except CommunicationError:
+        # the name server went away, maybe it moved: locate it again
+        forgetNS(host, port)
+        with Pyro.core.Proxy(sharedNS(host, port)._pyroUri) as nameserver:
+            return nameserver.lookup(name)
+
 def resolve(uri):
-    """Resolve a 'magic' uri (PYRONAME) into the direct PYRO uri."""
+    """
+    Resolve a 'magic' uri (PYRONAME) into the direct PYRO uri.
+    Lookups are cached for NS_CACHE_TTL seconds, failed lookups for NS_CACHE_NEGATIVE_TTL.
+    """
     if isinstance(uri, basestring):
         uri=Pyro.core.URI(uri)
     elif not isinstance(uri, Pyro.core.URI):
@@ -272,10 +437,8 @@ def resolve(uri):
         return uri
     log.debug("resolving %s",uri)
     if uri.protocol=="PYRONAME":
-        nameserver=locateNS(uri.host, uri.port)
-        uri=nameserver.lookup(uri.object)
-        nameserver._pyroRelease()
-        return uri
+        host,port,name=uri.host,uri.port,uri.object
+        return _nameCache.get((host,port,name), lambda: _lookup(host,port,name))
     else:
         raise PyroError("invalid uri protocol")
 
@@ -0,0 +1,184 @@
+"""
+Socket server based on an asyncio event loop.
+
+All connections are handled by a single event loop thread, which reads the
+Pyro messages without blocking. The method calls themselves are run in an
+executor (a thread pool by default), so that a slow call doesn't block
+the other clients. This scales to many mostly idle connections, because
+an idle connection costs a coroutine and its buffers instead of a thread.
+
+Requires Python 3.7 or newer.
+
+Pyro - Python Remote Objects.  Copyright by Irmen de Jong.
+irmen@razorvine.net - http://www.razorvine.net/python/Pyro
+"""
+
+import asyncio, logging, sys
+from concurrent.futures import ThreadPoolExecutor
+from Pyro.socketutil import createSocket
+from Pyro.errors import ConnectionClosedError, PyroError
+import Pyro.config
+import Pyro.core
+
+log=logging.getLogger("Pyro.socketserver.asyncio")
+
+class BufferedConnection(object):
+    """
+    Connection object handed to the daemon for a single message. The complete message
+    has already been read by the event loop, so recv() never blocks. Sent data is
+    collected and written out by the event loop afterwards.
+    """
+    __slots__=["parts","output","objectId"]
+    def __init__(self, *parts):
+        self.parts=list(parts)
+        self.output=[]
+        self.objectId=None
+    def send(self, data):
+        if type(data) in (list, tuple):
+            self.output.extend(data)
+        else:
+            self.output.append(data)
+    def recv(self, size):
+        # the daemon reads the header and the data separately, which are kept as separate
+        # parts, so normally a whole part is returned without copying anything
+        if not self.parts or len(self.parts[0])<size:
+            raise ConnectionClosedError("receiving: not enough data")
+        part=self.parts.pop(0)
+        if len(part)>size:
+            self.parts.insert(0, part[size:])
+            part=part[:size]
+        return part
+    def close(self):
+        pass
+    def getTimeout(self):
+        return None
+    def setTimeout(self, timeout):
+        pass
+    timeout=property(getTimeout,setTimeout)
+
+class SocketServer_Asyncio(object):
+    """transport server for socket connections, asyncio event loop version."""
+    def __init__(self, callbackObject, host, port, timeout=None, executor=None):
+        log.info("starting asyncio socketserver")
+        self.sock=None
+        self.sock=createSocket(bind=(host,port), timeout=timeout)
+        self.timeout=timeout or None
+        self.callback=callbackObject
+        if executor is None and Pyro.config.ASYNCIO_WORKERS>0:
+            executor=ThreadPoolExecutor(Pyro.config.ASYNCIO_WORKERS)
+        self.executor=executor    # None means: run the calls inline in the event loop
+        self.loop=None
+        self.wakeup=None
+        self.closing=False
+        self.clients={}    # handler task -> stream writer
+        sockaddr=self.sock.getsockname()
+        if sockaddr[0].startswith("127."):
+            if host is None or host.lower()!="localhost" and not host.startswith("127."):
+                log.warn("weird DNS setup: %s resolves to localhost (127.x.x.x)",host)
+        host=host or sockaddr[0]
+        port=port or sockaddr[1]
+        self.locationStr="%s:%d" % (host,port)
+    def __del__(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock=None
+
+    def requestLoop(self, loopCondition=lambda:True):
+        log.debug("enter asyncio requestloop")
+        self.loop=asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.serve(loopCondition))
+        except KeyboardInterrupt:
+            log.debug("stopping on break signal")
+        finally:
+            self.loop.close()
+            self.loop=None
+        log.debug("exit asyncio requestloop")
+
+    async def serve(self, loopCondition):
+        self.wakeup=asyncio.Event()
+        server=await asyncio.start_server(self.handleConnection, sock=self.sock)
+        try:
+            while loopCondition() and not self.closing:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), Pyro.config.POLLTIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+        finally:
+            server.close()
+            # closing the client connections ends their handlers
+            for writer in list(self.clients.values()):
+                writer.close()
+            await asyncio.gather(*list(self.clients.keys()), return_exceptions=True)
+            await server.wait_closed()
+            self.sock=None
+
+    async def readMessage(self, reader, timeout):
+        """read one complete Pyro message, returns a connection object holding the header and data"""
+        header=await asyncio.wait_for(reader.readexactly(Pyro.core.MessageFactory.HEADERSIZE), timeout)
+        msgType,flags,dataLen=Pyro.core.MessageFactory.parseMessageHeader(header) #@UnusedVariable (pydev)
+        data=await asyncio.wait_for(reader.readexactly(dataLen), self.timeout)
+        return BufferedConnection(header, data)
+
+    async def handleConnection(self, reader, writer):
+        log.debug("connection from %s",writer.get_extra_info("peername"))
+        task=asyncio.current_task()
+        self.clients[task]=writer
+        try:
+            if Pyro.config.CONNECTHANDSHAKE:
+                conn=await self.readMessage(reader, self.timeout)
+                if not self.callback.handshake(conn):
+                    return
+                await self.flush(writer, conn)
+            while True:
+                # no timeout while waiting for the next request, idle clients are fine
+                conn=await self.readMessage(reader, None)
+                if self.executor is None:
+                    self.callback.handleRequest(conn)
+                else:
+                    await self.loop.run_in_executor(self.executor, self.callback.handleRequest, conn)
+                await self.flush(writer, conn)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ConnectionClosedError):
+            # client went away.
+            pass
+        except PyroError:
+            x=sys.exc_info()[1]
+            log.warn("error on connection: %s",x)
+        finally:
+            self.clients.pop(task, None)
+            writer.close()
+
+    async def flush(self, writer, conn):
+        if conn.output:
+            writer.writelines(conn.output)
+            await writer.drain()
+
+    def handleRequests(self, eventsockets):
+        raise PyroError("the asyncio server runs its own event loop, it can't be used in an external one")
+
+    def close(self):
+        log.debug("closing socketserver")
+        self.closing=True
+        if self.loop is not None:
+            # the event loop owns the server socket now, it will close it when it stops
+            self.pingConnection()
+        elif self.sock:
+            self.sock.close()
+            self.sock=None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def fileno(self):
+        return self.sock.fileno()
+    def sockets(self):
+        return [self.sock]
+
+    def pingConnection(self):
+        """wake up the event loop, so that it notices a shutdown straight away"""
+        loop,wakeup=self.loop,self.wakeup
+        if loop is not None and wakeup is not None:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass    # loop already closed
@@ -62,10 +62,11 @@ def receiveData(sock, size):
     the exception object."""
     try:
         retrydelay=0.0
-        if hasattr(socket,"MSG_WAITALL"):
+        if hasattr(socket,"MSG_WAITALL") and sock.gettimeout() is None:
             # waitall is very convenient and if a socket error occurs,
             # we can assume the receive has failed. No need for a loop,
             # unless it is a retryable error.
+            # It doesn't wait for all data on sockets with a timeout, those use the loop below.
             while True:
                 try:
                     data=sock.recv(size, socket.MSG_WAITALL) #@UndefinedVariable (pydev)
@@ -81,6 +82,33 @@ def receiveData(sock, size):
                         raise ConnectionClosedError("receiving: connection lost: "+str(x))
                     time.sleep(0.00001+retrydelay)  # a slight delay to wait before retrying
                     retrydelay=__nextRetrydelay(retrydelay)                
+        if hasattr(sock,"recv_into"):
+            # receive straight into a preallocated buffer, no chunks to join afterwards
+            data=bytearray(size)
+            view=memoryview(data)
+            msglen=0
+            while True:
+                try:
+                    while msglen<size:
+                        # 60k buffer limit avoids problems on certain OSes like VMS, Windows
+                        received=sock.recv_into(view[msglen:], min(60000,size-msglen))
+                        if not received:
+                            break
+                        msglen+=received
+                    if msglen!=size:
+                        err=ConnectionClosedError("receiving: not enough data")
+                        err.partialData=bytes(view[:msglen])  # store the message that was received until now
+                        raise err
+                    return data  # yay, complete
+                except socket.timeout:
+                    raise TimeoutError("receiving: timeout")
+                except socket.error:
+                    x=sys.exc_info()[1]
+                    err=getattr(x,"errno",x.args[0])
+                    if err not in ERRNO_RETRIES:
+                        raise ConnectionClosedError("receiving: connection lost: "+str(x))
+                    time.sleep(0.00001+retrydelay)  # a slight delay to wait before retrying
+                    retrydelay=__nextRetrydelay(retrydelay)                
         # old fashioned recv loop, we gather chunks until the message is complete
         msglen=0
         chunks=[]
@@ -114,7 +142,18 @@ def receiveData(sock, size):
     
             
 def sendData(sock, data):
-    """Send some data over a socket."""
+    """Send some data over a socket. The data can also be a list of buffers,
+    they are sent one after another without being joined first."""
+    if type(data) in (list, tuple):
+        if sys.version_info<(3,0):
+            data=EMPTY_BYTES.join(data)
+        elif hasattr(sock,"sendmsg") and sock.gettimeout() is None:
+            sendBuffers(sock, data)
+            return
+        else:
+            for buf in data:
+                sendData(sock, buf)
+            return
     # Some OS-es have problems with sendall when the socket is in non-blocking mode.
     # For instance, Mac OS X seems to be happy to throw EAGAIN errors too often.
     # We fall back to using a regular send loop if needed.
@@ -131,7 +170,9 @@ def sendData(sock, data):
                 raise ConnectionClosedError("sending: connection lost: "+str(x))
     else:
         # Socket is in non-blocking mode, use regular send loop.
+        # The memoryview avoids copying the rest of the data after every partial send.
         retrydelay=0.0
+        data=memoryview(data)
         while data: 
             try: 
                 sent = sock.send(data) 
@@ -146,6 +187,27 @@ def sendData(sock, data):
                 time.sleep(0.00001+retrydelay)  # a slight delay to wait before retrying
                 retrydelay=__nextRetrydelay(retrydelay)                
 
+def sendBuffers(sock, buffers):
+    """Send a list of buffers over a blocking socket with sendmsg (scatter/gather I/O)."""
+    buffers=[memoryview(buf).cast("B") for buf in buffers if len(buf)]
+    while buffers:
+        try:
+            sent=sock.sendmsg(buffers[:512])    # stay well below IOV_MAX
+        except socket.timeout:
+            raise TimeoutError("sending: timeout")
+        except socket.error:
+            x=sys.exc_info()[1]
+            err=getattr(x,"errno",x.args[0])
+            if err in ERRNO_RETRIES:
+                continue
+            raise ConnectionClosedError("sending: connection lost: "+str(x))
+        # drop what has been sent, the first remaining buffer may have been sent partially
+        while buffers and sent>=len(buffers[0]):
+            sent-=len(buffers[0])
+            del buffers[0]
+        if sent:
+            buffers[0]=buffers[0][sent:]
+
 
 def createSocket(bind=None, connect=None, reuseaddr=True, keepalive=True, timeout=None):
     """Create a socket. Default options are keepalives and reuseaddr."""
@@ -7,8 +7,10 @@ irmen@razorvine.net - http://www.razorvine.net/python/Pyro
 
 import sys, zlib, logging, struct
 import traceback, linecache
+import Pyro.config
 import Pyro.constants
 import Pyro.errors
+from Pyro import threadutil
 
 log=logging.getLogger("Pyro.util")
 
@@ -163,17 +165,28 @@ class Serializer(object):
         import pickle
     if pickle.HIGHEST_PROTOCOL<2:
         raise RuntimeError("pickle serializer needs to support protocol 2 or higher")
-    def serialize(self, data, compress=False):
-        """Serialize the given data object, try to compress if told so.
-        Returns a tuple of the serialized data and a bool indicating if it is compressed or not."""
+    serializerId=0
+    name="pickle"
+    def encode(self, data):
+        """Serialize the given data object into a list of buffers, to be sent one after another."""
         version=struct.pack("!H",sys.hexversion>>16)
-        data=version+self.pickle.dumps(data, self.pickle.HIGHEST_PROTOCOL)
-        if compress and len(data)>200:       # don't waste time compressing small messages
+        return [version, self.pickle.dumps(data, self.pickle.HIGHEST_PROTOCOL)]
+    def serializeParts(self, data, compress=False):
+        """Serialize the given data object, try to compress if told so.
+        Returns a tuple of a list of buffers, to be sent one after another without joining
+        them, and a bool indicating if it is compressed or not."""
+        parts=self.encode(data)
+        if compress and sum(len(part) for part in parts)>200:       # don't waste time compressing small messages
+            data=bytes().join(parts)
             compressed=zlib.compress(data)
             if len(compressed)<len(data):
-                data=compressed     # compressed data is indeed smaller, use it
-                return data,True
-        return data,False
+                return [compressed],True     # compressed data is indeed smaller, use it
+        return parts,False
+    def serialize(self, data, compress=False):
+        """Serialize the given data object, try to compress if told so.
+        Returns a tuple of the serialized data and a bool indicating if it is compressed or not."""
+        parts,compressed=self.serializeParts(data, compress)
+        return bytes().join(parts),compressed
     def deserialize(self, data, compressed=False):
         """Deserializes the given data. Set compressed to True to decompress the data first."""
         if compressed:
@@ -185,12 +198,228 @@ class Serializer(object):
             otherminorv=otherversion&0xff
             raise Pyro.errors.CommunicationError("incompatible python version detected on other side: %d.%d" %(othermajorv,otherminorv))
         # version is ok, can unpickle
+        if sys.version_info>=(3,0):
+            data=memoryview(data)   # avoids copying the data to strip off the version
         return self.pickle.loads(data[2:])
     def __eq__(self, other):
         """this is only for the unit tests. It is not required."""
         return type(other) is Serializer and vars(self)==vars(other)
     __hash__=object.__hash__
 
+
+if Serializer.pickle.HIGHEST_PROTOCOL>=5:
+    class _OutOfBandBytes(object):
+        """Wraps a bytes object so that pickle protocol 5 passes it to the buffer_callback
+        as a PickleBuffer, instead of copying it into the pickle stream. It is unpickled as bytes again."""
+        __slots__=("data",)
+        def __init__(self, data):
+            self.data=data
+        def __reduce_ex__(self, protocol):
+            return bytes, (Serializer.pickle.PickleBuffer(self.data),)
+
+    class BinarySerializer(Serializer):
+        """
+        Serializer using pickle protocol 5, which sends large bytes objects out-of-band.
+        Bytes objects of at least Pyro.config.SERIALIZER_OOB_THRESHOLD bytes in the
+        arguments or the result are not copied into the pickle stream, but sent as
+        separate buffers after it, and are not copied when they are sent either.
+        Only available if pickle supports protocol 5 (Python 3.8 or newer), on both sides.
+        """
+        serializerId=1
+        name="binary"
+        protocol=5
+        headerStruct=struct.Struct("!II")     # pickle stream length, number of out-of-band buffers
+        def _wrapLargeBytes(self, obj, threshold, depth):
+            """Wrap the large bytes in the object, and in the containers inside it up to the given depth.
+            Long containers are not looked into, to keep this cheap for big listings.
+            Returns the object itself if nothing in it was wrapped."""
+            t=type(obj)
+            if t is bytes:
+                return _OutOfBandBytes(obj) if len(obj)>=threshold else obj
+            if depth>0 and (t is dict or t is list or t is tuple) and len(obj)<=16:
+                if t is dict:
+                    items=[(key, self._wrapLargeBytes(value, threshold, depth-1)) for key,value in obj.items()]
+                    if any(value is not obj[key] for key,value in items):
+                        return dict(items)
+                else:
+                    items=[self._wrapLargeBytes(item, threshold, depth-1) for item in obj]
+                    if any(new is not old for new,old in zip(items, obj)):
+                        return t(items)
+            return obj
+        def encode(self, data):
+            data=self._wrapLargeBytes(data, Pyro.config.SERIALIZER_OOB_THRESHOLD, 3)
+            buffers=[]
+            stream=self.pickle.dumps(data, self.protocol, buffer_callback=buffers.append)
+            buffers=[buf.raw() for buf in buffers]
+            header=self.headerStruct.pack(len(stream), len(buffers))
+            if not buffers:
+                return [header, stream]
+            lengths=struct.pack("!%dI" % len(buffers), *[len(buf) for buf in buffers])
+            return [header, stream, lengths]+buffers
+        def deserialize(self, data, compressed=False):
+            if compressed:
+                data=zlib.decompress(data)
+            data=memoryview(data)
+            streamLen,bufferCount=self.headerStruct.unpack_from(data)
+            pos=self.headerStruct.size
+            stream=data[pos:pos+streamLen]
+            if not bufferCount:
+                return self.pickle.loads(stream)
+            pos+=streamLen
+            lengths=struct.unpack_from("!%dI" % bufferCount, data, pos)
+            pos+=4*bufferCount
+            buffers=[]
+            for length in lengths:
+                buffers.append(data[pos:pos+length])
+                pos+=length
+            return self.pickle.loads(stream, buffers=buffers)
+        def __eq__(self, other):
+            """this is only for the unit tests. It is not required."""
+            return type(other) is BinarySerializer and vars(self)==vars(other)
+        __hash__=object.__hash__
+
+
+_serializers={}
+
+def registerSerializer(serializer):
+    """Make a serializer instance available for use in Pyro messages, under its serializerId (0-15)."""
+    if not 0<=serializer.serializerId<=15:
+        raise ValueError("serializerId must be 0-15")
+    _serializers[serializer.serializerId]=serializer
+
+def getSerializer(serializerId):
+    """Get the registered serializer with the given id."""
+    try:
+        return _serializers[serializerId]
+    except KeyError:
+        raise Pyro.errors.ProtocolError("unknown serializer id %d" % serializerId)
+
+def preferredSerializerIds():
+    """The ids of the registered serializers, the one named in Pyro.config.SERIALIZER first."""
+    ids=sorted(_serializers.keys(), reverse=True)
+    ids.sort(key=lambda i: _serializers[i].name!=Pyro.config.SERIALIZER)
+    return ids
+
+registerSerializer(Serializer())
+if Serializer.pickle.HIGHEST_PROTOCOL>=5:
+    registerSerializer(BinarySerializer())
+
+
+class ZlibCompressor(object):
+    """zlib compression, always available. This is what older Pyro versions use."""
+    compressorId=0
+    name="zlib"
+    def compress(self, data):
+        return zlib.compress(data, Pyro.config.COMPRESSION_LEVEL)
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+class Lz4Compressor(object):
+    """lz4 frame compression, much faster than zlib. Needs the lz4 module."""
+    compressorId=1
+    name="lz4"
+    def __init__(self):
+        import lz4.frame
+        self.lz4=lz4.frame
+    def compress(self, data):
+        return self.lz4.compress(data)
+    def decompress(self, data):
+        return self.lz4.decompress(data)
+
+class ZstdCompressor(object):
+    """zstd compression, fast and compact. Needs the zstandard module."""
+    compressorId=2
+    name="zstd"
+    def __init__(self):
+        import zstandard
+        self.zstd=zstandard
+    def compress(self, data):
+        # zstandard (de)compressor objects aren't threadsafe, so make new ones every time
+        return self.zstd.ZstdCompressor().compress(data)
+    def decompress(self, data):
+        return self.zstd.ZstdDecompressor().decompress(data)
+
+
+_compressors={}
+
+def registerCompressor(compressor):
+    """Make a compressor instance available for use in Pyro messages, under its compressorId (0-15)."""
+    if not 0<=compressor.compressorId<=15:
+        raise ValueError("compressorId must be 0-15")
+    _compressors[compressor.compressorId]=compressor
+
+def getCompressor(compressorId):
+    """Get the registered compressor with the given id."""
+    try:
+        return _compressors[compressorId]
+    except KeyError:
+        raise Pyro.errors.ProtocolError("unknown compressor id %d" % compressorId)
+
+def preferredCompressorIds():
+    """The ids of the registered compressors, the one named in Pyro.config.COMPRESSOR first."""
+    ids=sorted(_compressors.keys(), reverse=True)
+    ids.sort(key=lambda i: _compressors[i].name!=Pyro.config.COMPRESSOR)
+    return ids
+
+registerCompressor(ZlibCompressor())
+for compressorClass in (Lz4Compressor, ZstdCompressor):
+    try:
+        registerCompressor(compressorClass())
+    except ImportError:
+        pass    # module not installed, compressor not available
+del compressorClass
+
+
+class CompressionPolicy(object):
+    """
+    Decides which messages get compressed. Only messages of at least 'threshold'
+    bytes are compressed, and only for methods with compression enabled: the ones
+    in 'methods' set to True, or all others if 'enabled' is True. If enabled is
+    None, Pyro.config.COMPRESSION is followed.
+    When compressing a method's message doesn't save at least COMPRESSION_MINSAVING
+    of its size, the next messages for that method are sent uncompressed. The number
+    of messages skipped doubles each time this happens again, up to 64.
+    """
+    def __init__(self, enabled=None, threshold=None):
+        self.enabled=enabled
+        self.threshold=threshold or Pyro.config.COMPRESSION_THRESHOLD
+        self.methods={}     # method name -> bool, overrides enabled
+        self.__skip={}      # method name -> (messages to skip, current backoff)
+        self.__lock=threadutil.Lock()
+    def wants(self, method):
+        """does this method have compression enabled?"""
+        enabled=self.enabled
+        if enabled is None:
+            enabled=Pyro.config.COMPRESSION
+        return self.methods.get(method, enabled)
+    def compress(self, compressor, method, parts, wanted=None):
+        """Compress the message parts if the policy says so, or if wanted is true.
+        Returns a tuple of the (possibly) new parts and a bool indicating if they are compressed."""
+        size=sum(len(part) for part in parts)
+        if wanted is None:
+            wanted=self.wants(method)
+        if size<self.threshold or not wanted:
+            return parts,False
+        with self.__lock:
+            skip,backoff=self.__skip.get(method,(0,0))
+            if skip>0:
+                self.__skip[method]=(skip-1,backoff)
+                return parts,False
+        compressed=compressor.compress(bytes().join(parts))
+        with self.__lock:
+            if len(compressed)<=size*(1.0-Pyro.config.COMPRESSION_MINSAVING):
+                self.__skip.pop(method, None)
+                return [compressed],True
+            backoff=min(max(1,backoff*2),64)
+            self.__skip[method]=(backoff,backoff)
+        return parts,False
+    def __getstate__(self):
+        return self.enabled,self.threshold,self.methods
+    def __setstate__(self, state):
+        self.enabled,self.threshold,self.methods = state
+        self.__skip={}
+        self.__lock=threadutil.Lock()
+
 def resolveDottedAttribute(obj, attr, allowDotted):
     """Resolves a dotted attribute name to an object.  Raises
     an AttributeError if any attribute in the chain starts with a '_'.
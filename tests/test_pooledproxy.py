@@ -0,0 +1,100 @@
+"""
+Tests for a PooledProxy talking to a running thread pool server.
+
+Pyro - Python Remote Objects.  Copyright by Irmen de Jong.
+irmen@razorvine.net - http://www.razorvine.net/python/Pyro
+"""
+
+from __future__ import with_statement
+import unittest
+import time, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import Pyro.config
+import Pyro.core
+from Pyro import threadutil
+
+class MyThing(object):
+    def multiply(self,x,y):
+        return x*y
+    def delay(self, delay):
+        time.sleep(delay)
+        return delay
+
+class DaemonLoopThread(threadutil.Thread):
+    def __init__(self, pyrodaemon):
+        super(DaemonLoopThread,self).__init__()
+        self.setDaemon(True)
+        self.pyrodaemon=pyrodaemon
+        self.running=threadutil.Event()
+        self.running.clear()
+    def run(self):
+        self.running.set()
+        try:
+            self.pyrodaemon.requestLoop()
+        except:
+            print("Swallow exception from terminated daemon")
+
+class PooledProxyThreadServerTests(unittest.TestCase):
+    def setUp(self):
+        self.config=(Pyro.config.SERVERTYPE, Pyro.config.POLLTIMEOUT, Pyro.config.THREADPOOL_MINTHREADS, Pyro.config.THREADPOOL_MAXTHREADS,
+                     Pyro.config.PROXYPOOL_MAXIDLE, Pyro.config.PROXYPOOL_IDLETIMEOUT)
+        Pyro.config.SERVERTYPE="thread"
+        Pyro.config.POLLTIMEOUT=0.1
+        Pyro.config.THREADPOOL_MINTHREADS=2
+        Pyro.config.THREADPOOL_MAXTHREADS=2
+        Pyro.config.PROXYPOOL_MAXIDLE=2
+        Pyro.config.PROXYPOOL_IDLETIMEOUT=0.2
+        self.daemon=Pyro.core.Daemon(port=0)
+        self.objectUri=self.daemon.register(MyThing(), "something")
+        self.daemonthread=DaemonLoopThread(self.daemon)
+        self.daemonthread.start()
+        self.daemonthread.running.wait()
+    def tearDown(self):
+        time.sleep(0.05)
+        self.daemon.shutdown()
+        self.daemonthread.join()
+        Pyro.config.SERVERTYPE, Pyro.config.POLLTIMEOUT, Pyro.config.THREADPOOL_MINTHREADS, Pyro.config.THREADPOOL_MAXTHREADS, \
+            Pyro.config.PROXYPOOL_MAXIDLE, Pyro.config.PROXYPOOL_IDLETIMEOUT = self.config
+
+    def concurrentCalls(self, pooled, count):
+        results=[]
+        def call():
+            results.append(pooled.delay(0.2))
+        threads=[threadutil.Thread(target=call) for _ in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        return results
+
+    def testConnectionReuse(self):
+        with Pyro.core.PooledProxy(self.objectUri) as p:
+            for _ in range(5):
+                self.assertEqual(55, p.multiply(5,11))
+            self.assertEqual(1, p._PooledProxy__pyroCount)
+
+    def testMaxIdle(self):
+        Pyro.config.PROXYPOOL_MAXIDLE=1
+        Pyro.config.PROXYPOOL_IDLETIMEOUT=60
+        with Pyro.core.PooledProxy(self.objectUri, maxConnections=2) as pooled:
+            pooled._pyroTimeout=2
+            self.assertEqual([0.2]*2, self.concurrentCalls(pooled, 2))
+            self.assertEqual(1, pooled._PooledProxy__pyroCount)
+            self.assertEqual(1, len(pooled._PooledProxy__pyroIdle))
+
+    def testIdleTimeout(self):
+        with Pyro.core.PooledProxy(self.objectUri, maxConnections=2) as pooled:
+            pooled._pyroTimeout=2
+            self.assertEqual([0.2]*4, self.concurrentCalls(pooled, 4))
+            # both server worker threads are held by the idle connections
+            # until they time out, then another client gets served
+            time.sleep(0.5)
+            self.assertEqual(0, pooled._PooledProxy__pyroCount)
+            with Pyro.core.Proxy(self.objectUri) as p:
+                p._pyroTimeout=2
+                self.assertEqual(55, p.multiply(5,11))
+
+if __name__ == "__main__":
+    unittest.main()